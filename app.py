@@ -1,14 +1,37 @@
 import os
 import sqlite3
 import requests
-from flask import Flask, render_template, redirect, url_for, g, jsonify, request
-from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from flask import Flask, render_template, redirect, url_for, g, jsonify, request, Response, has_request_context
+from jinja2.utils import htmlsafe_json_dumps
+from datetime import datetime, timedelta, timezone
 import logging
 import websocket # For WebSocket API interaction
 import json
+import socket
+import hashlib
+import codecs
+import gzip
+import mimetypes
 from urllib.parse import urlparse
 import threading
 import time
+import atexit
+import itertools
+import random
+import queue
+import uuid
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_for_futures
+from contextlib import contextmanager
+import cProfile
+
+try:
+    import brotli  # Optional: serve br next to gzip when installed
+except ImportError:
+    brotli = None
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY,
+                               generate_latest, multiprocess)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(24)
@@ -16,71 +39,450 @@ app.config['SECRET_KEY'] = os.urandom(24)
 app.logger.setLevel(logging.INFO) # Set logging level to INFO by default
 
 # Configuration 
-HA_URL = "<YOUR HA_URL>"
-HA_TOKEN = "<YOUR API TOKEN>"
+HA_URL = os.environ.get('HA_URL', "<YOUR HA_URL>")
+HA_TOKEN = os.environ.get('HA_TOKEN', "<YOUR API TOKEN>")
 
 HEADERS = {
     "Authorization": f"Bearer {HA_TOKEN}",
     "Content-Type": "application/json",
 }
 
-DATABASE = 'data/usage.db'
+# Home Assistant REST client: timeouts (seconds), retries for reads, circuit breaker
+HA_CONNECT_TIMEOUT = float(os.environ.get('HA_CONNECT_TIMEOUT', 3))
+HA_READ_TIMEOUT = float(os.environ.get('HA_READ_TIMEOUT', 10))
+HA_READ_RETRIES = int(os.environ.get('HA_READ_RETRIES', 2))
+HA_BREAKER_THRESHOLD = int(os.environ.get('HA_BREAKER_THRESHOLD', 3))
+HA_BREAKER_COOLDOWN = float(os.environ.get('HA_BREAKER_COOLDOWN', 30))
+
+# Directory for usage.db and cache.db
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+DATABASE = os.path.join(DATA_DIR, 'usage.db')
+
+# Days of usage history behind the most-used ranking
+MOST_USED_DAYS = 30
+
+# Ranking scores can halve every MOST_USED_HALF_LIFE_DAYS days (0 disables
+# decay) and be kept apart for weekdays and weekends. All hourly rankings are
+# rebuilt every MOST_USED_REFRESH_INTERVAL seconds and bumped on activation.
+MOST_USED_HALF_LIFE_DAYS = float(os.environ.get('MOST_USED_HALF_LIFE_DAYS', 0))
+MOST_USED_SPLIT_WEEKENDS = os.environ.get('MOST_USED_SPLIT_WEEKENDS', 'false').lower() == 'true'
+MOST_USED_REFRESH_INTERVAL = float(os.environ.get('MOST_USED_REFRESH_INTERVAL', 3600))
+
+# Raw usage_log rows are kept this long; usage_histogram days older than
+# HISTOGRAM_RETENTION_DAYS (never within the ranking window) are folded into
+# monthly totals. Retention runs every USAGE_RETENTION_INTERVAL seconds.
+USAGE_RETENTION_DAYS = int(os.environ.get('USAGE_RETENTION_DAYS', 90))
+HISTOGRAM_RETENTION_DAYS = max(int(os.environ.get('HISTOGRAM_RETENTION_DAYS', 60)), MOST_USED_DAYS + 2)
+USAGE_RETENTION_INTERVAL = float(os.environ.get('USAGE_RETENTION_INTERVAL', 6 * 3600))
+
+# Entity id prefixes the dashboard shows
+TRACKED_DOMAINS = ('script.', 'scene.')
+
+# Multi-worker mode (set by gunicorn.conf.py): worker processes share the cache
+# through data/cache.db and elect one process to follow Home Assistant events
+SHARED_CACHE = os.environ.get('SHARED_CACHE', 'false').lower() == 'true'
+
+# Opt-in profiling: with PROFILING=true, a request carrying "X-Profile: 1" (or
+# ?profile=1) gets a Server-Timing header with its time per stage; the value
+# "cprofile" also dumps a cProfile of the request to DATA_DIR/profiles
+PROFILING = os.environ.get('PROFILING', 'false').lower() == 'true'
+
+# Acknowledge activations before Home Assistant has run the service; failures
+# are then reported through /api/activations/<activation_id>
+OPTIMISTIC_ACTIVATION = os.environ.get('OPTIMISTIC_ACTIVATION', 'false').lower() == 'true'
+
+# Repeat activations of an entity within this many seconds (double taps) are
+# acknowledged without calling Home Assistant or logging usage again; 0 disables
+ACTIVATION_DEBOUNCE_SECONDS = float(os.environ.get('ACTIVATION_DEBOUNCE_SECONDS', 1.0))
+MAX_BATCH_ACTIVATIONS = 50
+
+# Metrics, exposed in Prometheus format at /metrics. Under gunicorn every worker
+# writes its samples to PROMETHEUS_MULTIPROC_DIR and /metrics adds them up.
+DB_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+
+CACHE_REQUESTS = Counter('hapd_cache_requests_total', 'DataCache lookups', ['family', 'result'])
+CACHE_EVICTIONS = Counter('hapd_cache_evictions_total', 'Entries removed from DataCache', ['family', 'reason'])
+CACHE_ENTRIES = Gauge('hapd_cache_entries', 'Entries held by DataCache', multiprocess_mode='liveall')
+CACHE_BYTES = Gauge('hapd_cache_bytes', 'Serialized size of the entries held by DataCache',
+                    multiprocess_mode='liveall')
+CACHE_REFRESHES = Counter('hapd_cache_refreshes_total', 'Cache refreshes started', ['family', 'mode'])
+CACHE_REFRESHES_IN_FLIGHT = Gauge('hapd_cache_refreshes_in_flight', 'Cache refreshes running', ['family'],
+                                  multiprocess_mode='livesum')
+CACHE_REFRESH_SECONDS = Histogram('hapd_cache_refresh_duration_seconds', 'Cache refresh duration', ['family'])
+HA_REQUEST_SECONDS = Histogram('hapd_ha_request_duration_seconds', 'Home Assistant API call duration',
+                               ['api', 'endpoint'])
+HA_REQUEST_ERRORS = Counter('hapd_ha_request_errors_total', 'Failed Home Assistant API calls', ['api', 'endpoint'])
+DB_QUERY_SECONDS = Histogram('hapd_db_query_duration_seconds', 'SQLite query duration', ['query'],
+                             buckets=DB_BUCKETS)
+HTTP_REQUEST_SECONDS = Histogram('hapd_http_request_duration_seconds', 'Request latency by route',
+                                 ['route', 'method', 'status'])
+
+def _key_family(key):
+    """Metric label for a cache key; the per-hour most_used_* keys share one."""
+    return 'most_used' if key.startswith('most_used_') else key
+
+@contextmanager
+def _profile_stage(name):
+    """Add the time spent in the block to stage `name` of a profiled request."""
+    stages = g.get('profile_stages') if has_request_context() else None
+    if stages is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[name] = stages.get(name, 0) + time.perf_counter() - started
+
+@contextmanager
+def _timed_ha_call(api, endpoint):
+    """Record the duration, and failure if any, of one Home Assistant API call."""
+    started = time.perf_counter()
+    try:
+        with _profile_stage('ha_fetch'):
+            yield
+    except Exception:
+        HA_REQUEST_ERRORS.labels(api, endpoint).inc()
+        raise
+    finally:
+        HA_REQUEST_SECONDS.labels(api, endpoint).observe(time.perf_counter() - started)
+
+@contextmanager
+def _timed_query(name):
+    """Record the duration of a SQLite query or transaction."""
+    with DB_QUERY_SECONDS.labels(name).time(), _profile_stage('db'):
+        yield
 
 # Cache system
+CachePolicy = namedtuple('CachePolicy', 'ttl stale_after')
+
+# Per key family: how long (seconds) an entry may be served at all, and after
+# how long serving it also starts a background refresh (stale-while-revalidate)
+CACHE_POLICIES = {
+    'areas': CachePolicy(ttl=86400 * 7, stale_after=86400),  # Rarely change; events patch them anyway
+    'scripts_and_scenes': CachePolicy(ttl=86400 * 7, stale_after=3600),
+    'most_used': CachePolicy(ttl=86400, stale_after=900),  # One key per hour slot, rebuilt hourly
+    'last_good_snapshot': CachePolicy(ttl=86400 * 30, stale_after=86400 * 30),  # Only a fallback while warming up
+}
+DEFAULT_CACHE_POLICY = CachePolicy(ttl=86400 * 7, stale_after=3600)
+
+# Least recently used entries are evicted beyond these caps; the sweeper also
+# drops expired entries every CACHE_SWEEP_INTERVAL seconds
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1000))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+CACHE_SWEEP_INTERVAL = float(os.environ.get('CACHE_SWEEP_INTERVAL', 300))
+
+def _process_id():
+    """Identifies this worker process in shared state."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
 class DataCache:
-    def __init__(self):
-        self.cache = {}
+    """
+    In-memory cache persisted to a SQLite table in data/cache.db.
+    Writes only mark keys dirty; a background flusher coalesces bursts into one
+    transaction after flush_delay seconds, writing just the changed keys.
+    Every write gets an increasing sequence number, so with shared=True each
+    worker process polls for entries written (or deleted) by the others.
+    Expiry and staleness follow the CachePolicy of the key's family. Entries
+    are kept in least-recently-used order and evicted beyond max_entries or
+    max_bytes (serialized size); a sweeper thread drops expired entries.
+    """
+    def __init__(self, flush_delay=1.0, shared=False, sync_interval=0.5, policies=None,
+                 default_policy=DEFAULT_CACHE_POLICY, max_entries=1000, max_bytes=64 * 1024 * 1024,
+                 sweep_interval=300):
+        self.cache = OrderedDict()  # key -> (data, timestamp), least recently used first
         self.lock = threading.Lock()
-        self.cache_duration = 86400 * 7  # 7 days cache duration
-        self.cache_file = os.path.join('data', 'cache.json')
+        self.policies = policies or {}
+        self.default_policy = default_policy
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._sizes = {}  # key -> serialized size in bytes
+        self._bytes = 0
+        self.cache_file = os.path.join(DATA_DIR, 'cache.db')
+        self.legacy_cache_file = os.path.join(DATA_DIR, 'cache.json')
+        self.flush_delay = flush_delay
+        self.shared = shared
+        self.sync_interval = sync_interval
+        self._dirty = set()
+        self._flush_lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._flusher = None
+        self._conn = None
+        self._seq = 0  # Highest sequence number seen on disk
+        self._data_version = None
+        self._listeners = []
         self._load_cache_from_disk()
-        
+        atexit.register(self.flush)
+        if shared:
+            threading.Thread(target=self._sync_loop, name='cache-sync', daemon=True).start()
+        threading.Thread(target=self._sweep_loop, name='cache-sweeper', daemon=True).start()
+
+    def _connect(self):
+        """Open (once) the cache database, creating the table if needed."""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            conn = sqlite3.connect(self.cache_file, check_same_thread=False, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(cache)')]
+            if columns and 'seq' not in columns:
+                conn.execute('ALTER TABLE cache RENAME TO cache_v1')
+            # value is NULL for deleted entries, so other workers see the deletion
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    timestamp REAL NOT NULL,
+                    seq INTEGER NOT NULL DEFAULT 0,
+                    owner TEXT
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_seq ON cache (seq)')
+            if columns and 'seq' not in columns:
+                conn.execute('INSERT INTO cache (key, value, timestamp) SELECT key, value, timestamp FROM cache_v1')
+                conn.execute('DROP TABLE cache_v1')
+            # Tombstones only need to live long enough for every worker to sync
+            conn.execute('DELETE FROM cache WHERE value IS NULL AND timestamp < ?', (time.time() - 3600,))
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
     def _load_cache_from_disk(self):
         """Load cache from disk on startup."""
         try:
-            if os.path.exists(self.cache_file):
-                with open(self.cache_file, 'r') as f:
-                    disk_cache = json.load(f)
-                    with self.lock:
-                        self.cache = disk_cache
-                app.logger.info(f"Loaded cache from disk with {len(self.cache)} entries")
+            with self._flush_lock:
+                conn = self._connect()
+                self._data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+                rows = conn.execute('SELECT key, value, timestamp, seq FROM cache').fetchall()
+            now = time.time()
+            with self.lock:
+                # Oldest first, so the LRU order starts out as write order
+                for key, value, timestamp, _ in sorted(rows, key=lambda row: row[2]):
+                    if value is None:
+                        continue
+                    if now - timestamp >= self._policy(key).ttl:
+                        self._mark_dirty([key])  # Delete from disk too
+                        continue
+                    self._store(key, json.loads(value), timestamp, len(value))
+                self._seq = max((seq for *_, seq in rows), default=0)
+                self._evict_over_limits()
+            app.logger.info(f"Loaded cache from disk with {len(self.cache)} entries")
         except Exception as e:
             app.logger.error(f"Error loading cache from disk: {e}")
-    
-    def _save_cache_to_disk(self):
-        """Save cache to disk."""
+
+        self._migrate_legacy_cache()
+
+    def _migrate_legacy_cache(self):
+        """Import entries from the old cache.json file once, then remove it."""
+        if not os.path.exists(self.legacy_cache_file):
+            return
         try:
-            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
-            with open(self.cache_file, 'w') as f:
-                with self.lock:
-                    json.dump(self.cache, f)
+            with open(self.legacy_cache_file, 'r') as f:
+                disk_cache = json.load(f)
+            with self.lock:
+                for key, (data, timestamp) in disk_cache.items():
+                    if key not in self.cache:
+                        self._store(key, data, timestamp, len(json.dumps(data)))
+                    self._dirty.add(key)
+                self._evict_over_limits()
+            self.flush()
+            os.remove(self.legacy_cache_file)
+            app.logger.info(f"Migrated {len(disk_cache)} entries from {self.legacy_cache_file}")
         except Exception as e:
-            app.logger.error(f"Error saving cache to disk: {e}")
+            app.logger.error(f"Error migrating legacy cache file: {e}")
+
+    def _policy(self, key):
+        return self.policies.get(_key_family(key), self.default_policy)
+
+    def _store(self, key, data, timestamp, size):
+        """Insert or replace an entry as the most recently used (caller holds self.lock)."""
+        self._bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+        self.cache[key] = (data, timestamp)
+        self.cache.move_to_end(key)
+        self._update_size_gauges()
+
+    def _discard(self, key):
+        """Drop an entry from memory (caller holds self.lock). Returns whether it was cached."""
+        if self.cache.pop(key, None) is None:
+            return False
+        self._bytes -= self._sizes.pop(key, 0)
+        self._update_size_gauges()
+        return True
+
+    def _update_size_gauges(self):
+        """Publish the entry count and size to /metrics (caller holds self.lock)."""
+        CACHE_ENTRIES.set(len(self.cache))
+        CACHE_BYTES.set(self._bytes)
+
+    def _evict_over_limits(self):
+        """Evict least recently used entries beyond the caps (caller holds self.lock)."""
+        evicted = []
+        # Never evict the last entry, however large: it was just written
+        while len(self.cache) > 1 and (len(self.cache) > self.max_entries or self._bytes > self.max_bytes):
+            key = next(iter(self.cache))
+            self._discard(key)
+            evicted.append(key)
+            CACHE_EVICTIONS.labels(_key_family(key), 'lru').inc()
+        if evicted:
+            self._mark_dirty(evicted)
+        return evicted
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                app.logger.error(f"Error sweeping cache: {e}")
+
+    def sweep(self):
+        """Drop expired entries and enforce the caps. Returns the number of entries removed."""
+        now = time.time()
+        with self.lock:
+            expired = [key for key, (_, timestamp) in self.cache.items() if now - timestamp >= self._policy(key).ttl]
+            for key in expired:
+                self._discard(key)
+                CACHE_EVICTIONS.labels(_key_family(key), 'expired').inc()
+            if expired:
+                self._mark_dirty(expired)
+            evicted = self._evict_over_limits()
+        if expired or evicted:
+            app.logger.debug("Cache sweep removed %s expired and %s evicted entries", len(expired), len(evicted))
+        return len(expired) + len(evicted)
+
+    def add_listener(self, callback):
+        """Register callback(keys), called after entries are set or cleared."""
+        self._listeners.append(callback)
+
+    def _notify(self, keys):
+        for callback in self._listeners:
+            try:
+                callback(keys)
+            except Exception as e:
+                app.logger.error(f"Error in cache listener: {e}")
+
+    def _mark_dirty(self, keys):
+        """Record changed keys (caller holds self.lock) and wake the flusher."""
+        self._dirty.update(keys)
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='cache-flusher', daemon=True)
+            self._flusher.start()
+        self._flush_requested.set()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_requested.wait()
+            # Debounce: let a burst of writes settle into a single transaction
+            time.sleep(self.flush_delay)
+            self._flush_requested.clear()
+            self.flush()
+
+    def flush(self):
+        """Write dirty keys to disk in one transaction."""
+        with self._flush_lock:
+            with self.lock:
+                if not self._dirty:
+                    return
+                changes = {key: self.cache.get(key) for key in self._dirty}
+                self._dirty.clear()
+
+            try:
+                # Serialize outside self.lock; cached values are replaced, never mutated
+                now = time.time()
+                rows = [(key, json.dumps(entry[0]) if entry is not None else None, entry[1] if entry is not None else now)
+                        for key, entry in changes.items()]
+                conn = self._connect()
+                # Take the write lock up front so sequence numbers follow commit order
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    base = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM cache').fetchone()[0]
+                    conn.executemany('INSERT OR REPLACE INTO cache (key, value, timestamp, seq, owner) VALUES (?, ?, ?, ?, ?)',
+                                     [(key, value, timestamp, base + n, _process_id()) for n, (key, value, timestamp) in enumerate(rows, 1)])
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            except Exception as e:
+                app.logger.error(f"Error saving cache to disk: {e}")
+                with self.lock:
+                    self._dirty.update(changes)
+                self._flush_requested.set()
         
-    def get(self, key):
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                app.logger.error(f"Error syncing cache from disk: {e}")
+
+    def sync(self):
+        """Apply entries other worker processes wrote since the last sync."""
+        with self._flush_lock:
+            conn = self._connect()
+            # data_version only changes when another connection commits
+            data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self._data_version:
+                return
+            self._data_version = data_version
+            rows = conn.execute('SELECT key, value, timestamp, seq, owner FROM cache WHERE seq > ? ORDER BY seq',
+                                (self._seq,)).fetchall()
+
+        me = _process_id()
+        updates = [(key, json.loads(value) if value is not None else None, timestamp, len(value or ''))
+                   for key, value, timestamp, seq, owner in rows if owner != me]
+        changed = []
         with self.lock:
+            if rows:
+                self._seq = max(self._seq, rows[-1][3])
+            for key, data, timestamp, size in updates:
+                if key in self._dirty:
+                    continue  # Our pending write wins
+                if data is None:
+                    if self._discard(key):
+                        changed.append(key)
+                else:
+                    self._store(key, data, timestamp, size)
+                    changed.append(key)
+            # Other workers' evictions reach us as deletes; ours need not go back
+            for key in self._evict_over_limits():
+                self._dirty.discard(key)
+        if changed:
+            self._notify(changed)
+
+    def get(self, key):
+        family = _key_family(key)
+        with _profile_stage('cache'), self.lock:
             if key in self.cache:
                 data, timestamp = self.cache[key]
-                if time.time() - timestamp < self.cache_duration:
+                if time.time() - timestamp < self._policy(key).ttl:
+                    self.cache.move_to_end(key)
+                    CACHE_REQUESTS.labels(family, 'hit').inc()
                     return data
                 else:
                     # Remove expired cache entry
-                    del self.cache[key]
-                    self._save_cache_to_disk()
+                    self._discard(key)
+                    self._mark_dirty([key])
+                    CACHE_EVICTIONS.labels(family, 'expired').inc()
+            CACHE_REQUESTS.labels(family, 'miss').inc()
             return None
     
     def set(self, key, data):
+        size = len(json.dumps(data))
         with self.lock:
-            self.cache[key] = (data, time.time())
-        # Save to disk in background thread to avoid blocking
-        threading.Thread(target=self._save_cache_to_disk, daemon=True).start()
+            self._store(key, data, time.time(), size)
+            self._mark_dirty([key])
+            self._evict_over_limits()
+        self._notify([key])
     
     def is_stale(self, key):
         with self.lock:
             if key in self.cache:
                 _, timestamp = self.cache[key]
-                # Consider stale if older than 1 hour for background refresh
-                return time.time() - timestamp > 3600
+                # Past the family's stale_after, readers also start a background refresh
+                return time.time() - timestamp > self._policy(key).stale_after
             return True
     
     def clear_cache_pattern(self, pattern):
@@ -88,31 +490,566 @@ class DataCache:
         with self.lock:
             keys_to_remove = [key for key in self.cache.keys() if pattern in key]
             for key in keys_to_remove:
-                del self.cache[key]
-        # Save to disk in background thread
-        threading.Thread(target=self._save_cache_to_disk, daemon=True).start()
+                self._discard(key)
+                CACHE_EVICTIONS.labels(_key_family(key), 'cleared').inc()
+            self._mark_dirty(keys_to_remove)
+        self._notify(keys_to_remove)
 
 # Global cache instance
-data_cache = DataCache()
+data_cache = DataCache(flush_delay=0.25 if SHARED_CACHE else 1.0, shared=SHARED_CACHE, policies=CACHE_POLICIES,
+                       max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, sweep_interval=CACHE_SWEEP_INTERVAL)
+
+# Cross-process coordination
+class SharedState:
+    """
+    Coordination state shared by worker processes through data/cache.db:
+    expiring named leases (to pick one process for a job) and the outcomes of
+    optimistic activations (so any worker can report them).
+    """
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS activations (
+                    activation_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    updated REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS recent_activations (
+                    entity_id TEXT PRIMARY KEY,
+                    activation_id TEXT NOT NULL,
+                    expires REAL NOT NULL
+                )
+            ''')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def acquire(self, name, ttl):
+        """Take or renew the lease `name` for ttl seconds. Returns True if this process holds it."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute('''
+                    INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires
+                    WHERE leases.owner = excluded.owner OR leases.expires < ?
+                ''', (name, _process_id(), now + ttl, now))
+            return cursor.rowcount == 1
+
+    def release(self, name):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, _process_id()))
+
+    def is_held(self, name):
+        """True if any process holds an unexpired lease `name`."""
+        with self._lock:
+            row = self._connect().execute('SELECT expires FROM leases WHERE name = ?', (name,)).fetchone()
+        return row is not None and row[0] > time.time()
+
+    def set_activation_status(self, activation_id, status, keep_for=3600):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO activations (activation_id, status, updated) VALUES (?, ?, ?)',
+                             (activation_id, status, now))
+                conn.execute('DELETE FROM activations WHERE updated < ?', (now - keep_for,))
+
+    def get_activation_status(self, activation_id):
+        with self._lock:
+            row = self._connect().execute('SELECT status FROM activations WHERE activation_id = ?',
+                                          (activation_id,)).fetchone()
+        return row[0] if row else None
+
+    def claim_activations(self, claims, window):
+        """
+        Claim entities for window seconds on behalf of new activations, whichever
+        process asks. claims maps entity_id -> activation_id; returns entity_id ->
+        the activation holding the claim, which is an earlier one for entities
+        already claimed within the window.
+        """
+        now = time.time()
+        held = {}
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('DELETE FROM recent_activations WHERE expires < ?', (now,))
+                for entity_id, activation_id in claims.items():
+                    conn.execute('''
+                        INSERT OR IGNORE INTO recent_activations (entity_id, activation_id, expires) VALUES (?, ?, ?)
+                    ''', (entity_id, activation_id, now + window))
+                    held[entity_id] = conn.execute('SELECT activation_id FROM recent_activations WHERE entity_id = ?',
+                                                   (entity_id,)).fetchone()[0]
+        return held
+
+    def release_activation(self, entity_id, activation_id):
+        """Drop an entity's claim if activation_id still holds it."""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('DELETE FROM recent_activations WHERE entity_id = ? AND activation_id = ?',
+                             (entity_id, activation_id))
+
+shared_state = SharedState(data_cache.cache_file)
+
+# Request coalescing
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; concurrent callers for the same key
+    wait for and share the in-flight call's result. Background calls run on a
+    bounded worker pool instead of ad-hoc threads.
+    Keys are cache keys: with a shared cache, a lease also limits each refresh
+    to one worker process, and the others pick up its result from the cache.
+    Pass force=True when the cached value is known to be outdated (events were
+    missed, usage was just recorded) and must be fetched even if still fresh.
+    """
+    def __init__(self, cache, shared_state, max_workers=4, lease_ttl=60):
+        self.cache = cache
+        self.shared_state = shared_state
+        self.lease_ttl = lease_ttl
+        self._calls = {}  # key -> Future of the in-flight call
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cache-refresh')
+
+    def _claim(self, key):
+        """Return (future, is_leader) for key, registering a new call if none is in flight."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _call(self, key, fn, args, wait, force):
+        """Call fn unless another worker process is already refreshing key or just did."""
+        if not self.cache.shared:
+            return fn(*args)
+
+        lease = f'refresh:{key}'
+        if self.shared_state.acquire(lease, self.lease_ttl):
+            try:
+                if not force:
+                    # The previous lease holder may have published key since we missed it
+                    self.cache.sync()
+                    cached = self.cache.get(key)
+                    if cached is not None and not self.cache.is_stale(key):
+                        return cached
+                result = fn(*args)
+                self.cache.flush()  # Publish before releasing the lease
+                return result
+            finally:
+                self.shared_state.release(lease)
+
+        if not wait:
+            return None
+        # Another worker is fetching; wait for its result to land in the cache
+        started = time.time()
+        while self.shared_state.is_held(lease) and time.time() - started < self.lease_ttl:
+            time.sleep(0.1)
+        self.cache.sync()
+        return self.cache.get(key)
+
+    def _run(self, key, future, fn, args, wait=True, force=False):
+        family = _key_family(key)
+        CACHE_REFRESHES.labels(family, 'foreground' if wait else 'background').inc()
+        CACHE_REFRESHES_IN_FLIGHT.labels(family).inc()
+        try:
+            with CACHE_REFRESH_SECONDS.labels(family).time():
+                future.set_result(self._call(key, fn, args, wait, force))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            CACHE_REFRESHES_IN_FLIGHT.labels(family).dec()
+            with self._lock:
+                del self._calls[key]
+
+    def do(self, key, fn, *args, force=False):
+        """Call fn(*args), or join the call already in flight for key, and return its result."""
+        future, is_leader = self._claim(key)
+        if is_leader:
+            self._run(key, future, fn, args, force=force)
+        return future.result()
+
+    def submit(self, key, fn, *args, force=False):
+        """Schedule fn(*args) on the worker pool unless a call for key is already in flight."""
+        future, is_leader = self._claim(key)
+        if is_leader:
+            self._executor.submit(self._run, key, future, fn, args, False, force)
+        return future
+
+single_flight = SingleFlight(data_cache, shared_state)
+
+# Home Assistant WebSocket client
+def _ha_websocket_url():
+    """Derive the WebSocket API URL from HA_URL."""
+    parsed = urlparse(HA_URL)
+    ws_scheme = 'wss' if parsed.scheme == 'https' else 'ws'
+    return f"{ws_scheme}://{parsed.netloc}/api/websocket"
+
+class HAWebSocketClient:
+    """
+    Long-lived, authenticated session with the Home Assistant WebSocket API.
+    Commands are correlated with their results by message id, so concurrent
+    callers share (and pipeline over) a single socket. A background thread owns
+    the connection and reconnects with exponential backoff when it drops.
+    Event subscriptions are re-established on every (re)connect; their callbacks
+    run in order on a dedicated thread so they may issue commands themselves.
+    """
+    def __init__(self, url, token, timeout=10, heartbeat=30, max_backoff=60):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+        self.heartbeat = heartbeat
+        self.max_backoff = max_backoff
+        self._ws = None
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._send_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._connected = threading.Event()
+        self._live = threading.Event()
+        self._last_error = None
+        self._thread = None
+        self._subscriptions = {}  # event_type -> [callback]
+        self._subscription_ids = {}  # message id -> event_type, for the current connection
+        self._connect_listeners = []
+        self._events_enabled = True
+        self._events = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ha-ws-events')
+
+    def start(self):
+        """Start the connection thread if it is not already running."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ha-websocket', daemon=True)
+                self._thread.start()
+
+    @property
+    def connected(self):
+        return self._connected.is_set()
+
+    @property
+    def live(self):
+        """True while connected with every event subscription active."""
+        return self._live.is_set()
+
+    def subscribe_events(self, event_type, callback):
+        """Register a callback for an HA event type, kept across reconnects."""
+        self._subscriptions.setdefault(event_type, []).append(callback)
+
+    def add_connect_listener(self, callback):
+        """Register a callback run after each (re)connect, once subscriptions are active."""
+        self._connect_listeners.append(callback)
+
+    @property
+    def events_enabled(self):
+        return self._events_enabled
+
+    def set_events_enabled(self, enabled):
+        """
+        Turn event subscriptions (and connect listeners) on or off. In multi-worker
+        mode only the process holding the event lease follows HA events.
+        """
+        if enabled == self._events_enabled:
+            return
+        self._events_enabled = enabled
+        if enabled:
+            if self.connected:
+                self._events.submit(self._on_connected)
+        else:
+            self._events.submit(self._unsubscribe_all)
+
+    def _connect(self):
+        """Open a socket and run the auth_required/auth handshake."""
+        ws = websocket.create_connection(self.url, timeout=self.timeout)
+        try:
+            auth_req = json.loads(ws.recv())
+            if auth_req.get('type') != 'auth_required':
+                raise RuntimeError(f"Unexpected WS response during auth_required: {auth_req.get('type', '')}")
+
+            ws.send(json.dumps({'type': 'auth', 'access_token': self.token}))
+            auth_res = json.loads(ws.recv())
+            if auth_res.get('type') != 'auth_ok':
+                raise RuntimeError(f"WS auth failed: {auth_res.get('message', '')}")
+        except Exception:
+            ws.close()
+            raise
+        ws.settimeout(self.heartbeat)
+        return ws
+
+    def _run(self):
+        """Connection loop: connect, read until the socket drops, back off, repeat."""
+        backoff = 1
+        while True:
+            try:
+                ws = self._connect()
+            except Exception as e:
+                self._last_error = e
+                delay = backoff + random.uniform(0, backoff / 2)
+                app.logger.error(f"WebSocket connection to Home Assistant failed, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = 1
+            with self._send_lock:
+                self._ws = ws
+            self._last_error = None
+            self._connected.set()
+            app.logger.info("Connected to Home Assistant WebSocket API")
+            self._events.submit(self._on_connected)
+
+            try:
+                self._read_loop(ws)
+            except Exception as e:
+                self._last_error = e
+                app.logger.warning(f"Home Assistant WebSocket connection lost: {e}")
+            finally:
+                self._live.clear()
+                self._connected.clear()
+                with self._send_lock:
+                    self._ws = None
+                    self._subscription_ids.clear()
+                try:
+                    ws.close()
+                except Exception:
+                    pass
+                self._fail_pending(ConnectionError('Home Assistant WebSocket connection lost'))
+
+    def _read_loop(self, ws):
+        """Dispatch incoming messages, pinging HA when the socket goes quiet."""
+        ping_outstanding = False
+        while True:
+            try:
+                raw = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                if ping_outstanding:
+                    raise ConnectionError('Heartbeat timed out')
+                ping_outstanding = True
+                with self._send_lock:
+                    ws.send(json.dumps({'id': next(self._ids), 'type': 'ping'}))
+                continue
+            ping_outstanding = False
+            message = json.loads(raw)
+            for msg in (message if isinstance(message, list) else [message]):
+                self._dispatch(msg)
+
+    def _on_connected(self):
+        """Subscribe to registered event types, then notify connect listeners."""
+        if not self._events_enabled or self._live.is_set():
+            return
+        try:
+            for event_type in list(self._subscriptions):
+                self.call('subscribe_events', event_type=event_type, _event_type=event_type)
+        except Exception as e:
+            app.logger.error(f"Failed to subscribe to Home Assistant events: {e}")
+            return
+        self._live.set()
+        for listener in self._connect_listeners:
+            try:
+                listener()
+            except Exception as e:
+                app.logger.error(f"Error in WebSocket connect listener: {e}")
+
+    def _unsubscribe_all(self):
+        self._live.clear()
+        with self._send_lock:
+            subscription_ids = list(self._subscription_ids)
+        for subscription_id in subscription_ids:
+            try:
+                self.call('unsubscribe_events', subscription=subscription_id)
+            except Exception as e:
+                app.logger.warning(f"Failed to unsubscribe from Home Assistant events: {e}")
+            with self._send_lock:
+                self._subscription_ids.pop(subscription_id, None)
+
+    def _handle_event(self, event_type, event):
+        for callback in self._subscriptions.get(event_type, []):
+            try:
+                callback(event)
+            except Exception as e:
+                app.logger.error(f"Error handling Home Assistant {event_type} event: {e}")
+
+    def _dispatch(self, message):
+        """Route events to their subscribers and results to the pending call."""
+        if message.get('type') == 'event':
+            event_type = self._subscription_ids.get(message.get('id'))
+            if event_type is not None:
+                self._events.submit(self._handle_event, event_type, message.get('event') or {})
+            return
+        if message.get('type') not in ('result', 'pong'):
+            return
+        with self._pending_lock:
+            future = self._pending.get(message.get('id'))
+        if future is not None and not future.done():
+            future.set_result(message)
+
+    def _fail_pending(self, exc):
+        with self._pending_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(exc)
+
+    def call(self, msg_type, timeout=None, _event_type=None, **payload):
+        """
+        Send a command and block until its result arrives.
+        Raises ConnectionError when HA is unreachable and RuntimeError when the
+        command itself fails.
+        """
+        with _timed_ha_call('websocket', msg_type):
+            return self._call(msg_type, timeout, _event_type, payload)
+
+    def send(self, msg_type, **payload):
+        """
+        Send a command without waiting for it and return a Future of its result,
+        which fails like call() does. Lets a caller put a burst of commands on
+        the wire and then wait for all of them together. Cancelling the Future
+        stops tracking the command.
+        """
+        started = time.perf_counter()
+        try:
+            msg_id, message = self._send(msg_type, self.timeout, None, payload)
+        except Exception:
+            HA_REQUEST_ERRORS.labels('websocket', msg_type).inc()
+            raise
+        result = Future()
+
+        def resolve(message):
+            HA_REQUEST_SECONDS.labels('websocket', msg_type).observe(time.perf_counter() - started)
+            try:
+                value = self._unwrap(msg_type, message.result())
+            except Exception as e:
+                HA_REQUEST_ERRORS.labels('websocket', msg_type).inc()
+                if result.set_running_or_notify_cancel():
+                    result.set_exception(e)
+                return
+            if result.set_running_or_notify_cancel():
+                result.set_result(value)
+
+        def forget(_):
+            with self._pending_lock:
+                self._pending.pop(msg_id, None)
+
+        result.add_done_callback(forget)
+        message.add_done_callback(resolve)
+        return result
+
+    def _send(self, msg_type, timeout, _event_type, payload):
+        """Send a command; returns its message id and a Future of the reply message."""
+        self.start()
+        # Fail fast while reconnecting instead of stalling the caller
+        if not self._connected.wait(0 if self._last_error else timeout):
+            raise ConnectionError(f"Not connected to Home Assistant WebSocket API: {self._last_error}")
+
+        future = Future()
+        # HA requires message ids to increase, so allocate and send under one lock
+        with self._send_lock:
+            if self._ws is None:
+                raise ConnectionError('Home Assistant WebSocket connection lost')
+            msg_id = next(self._ids)
+            with self._pending_lock:
+                self._pending[msg_id] = future
+            if _event_type is not None:
+                # Map the subscription before HA can deliver its first event
+                self._subscription_ids[msg_id] = _event_type
+            try:
+                self._ws.send(json.dumps(dict(payload, id=msg_id, type=msg_type)))
+            except Exception:
+                with self._pending_lock:
+                    self._pending.pop(msg_id, None)
+                raise
+        return msg_id, future
+
+    def _call(self, msg_type, timeout, _event_type, payload):
+        timeout = self.timeout if timeout is None else timeout
+        msg_id, future = self._send(msg_type, timeout, _event_type, payload)
+        try:
+            message = future.result(timeout)
+        finally:
+            with self._pending_lock:
+                self._pending.pop(msg_id, None)
+        return self._unwrap(msg_type, message)
+
+    @staticmethod
+    def _unwrap(msg_type, message):
+        """The result of a reply message, or RuntimeError if the command failed."""
+        if message.get('type') == 'result' and not message.get('success'):
+            error = message.get('error') or {}
+            raise RuntimeError(f"Home Assistant command {msg_type} failed: {error.get('message', '')}")
+        return message.get('result')
+
+# Global WebSocket session, connected lazily on first use
+ha_ws = HAWebSocketClient(_ha_websocket_url(), HA_TOKEN)
+
+# Database connections
+class ConnectionPool:
+    """
+    Reuses one SQLite connection per thread (request handlers, refresh workers
+    and the usage writer alike) instead of reconnecting for every request.
+    Connections run in WAL mode, so activation writes don't block most-used
+    reads, and keep their prepared statements for the life of the thread.
+    """
+    def __init__(self, database, cache_size_kib=8192):
+        self.database = database
+        self.cache_size_kib = cache_size_kib
+        self._local = threading.local()
+
+    def connection(self):
+        """This thread's connection, opened on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.database), exist_ok=True)
+            # sqlite3 prepares each distinct SQL string once per connection and
+            # reuses it, so hot queries keep their SQL text constant
+            conn = sqlite3.connect(self.database, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')  # Durable at checkpoints, safe in WAL mode
+            conn.execute(f'PRAGMA cache_size=-{self.cache_size_kib}')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            self._local.conn = conn
+        return conn
+
+    def release(self):
+        """Roll back anything this thread left uncommitted; the connection stays open."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and conn.in_transaction:
+            conn.rollback()
+
+usage_db = ConnectionPool(DATABASE)
 
 def get_db():
-    db = getattr(g, '_database', None)
-    if db is None:
-        os.makedirs(os.path.dirname(DATABASE), exist_ok=True)
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
-    return db
+    return usage_db.connection()
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+    usage_db.release()
 
 def init_db():
     with app.app_context():
         db = get_db()
         cursor = db.cursor()
+
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS usage_log (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -120,310 +1057,1461 @@ def init_db():
                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_usage_log_timestamp ON usage_log (timestamp)')
+
+        # Per-entity activation counts by day and minute of day (UTC, like usage_log)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS usage_histogram (
+                day TEXT NOT NULL,
+                minute_of_day INTEGER NOT NULL,
+                entity_id TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, minute_of_day, entity_id)
+            ) WITHOUT ROWID
+        ''')
+
+        # Backfill the histogram from existing log rows once. user_version marks
+        # it done: a histogram emptied by retention must not be refilled from old
+        # log rows, which would fold them into usage_monthly a second time.
+        # Databases that already have usage_monthly were histogrammed before the
+        # marker existed.
+        cursor.execute('BEGIN IMMEDIATE')  # Workers booting together backfill once
+        if cursor.execute('PRAGMA user_version').fetchone()[0] < 1:
+            cursor.execute('''
+                SELECT EXISTS (SELECT 1 FROM usage_histogram)
+                    OR EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'usage_monthly')
+            ''')
+            if not cursor.fetchone()[0]:
+                cursor.execute('''
+                    INSERT INTO usage_histogram (day, minute_of_day, entity_id, count)
+                    SELECT DATE(timestamp),
+                           CAST(STRFTIME('%H', timestamp) AS INTEGER) * 60 + CAST(STRFTIME('%M', timestamp) AS INTEGER),
+                           entity_id, COUNT(*)
+                    FROM usage_log
+                    GROUP BY 1, 2, 3
+                ''')
+            cursor.execute('PRAGMA user_version = 1')
         db.commit()
 
+        # Precomputed ranking scores per hour slot, see RankingEngine
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS most_used_scores (
+                day_type TEXT NOT NULL,
+                hour INTEGER NOT NULL,
+                entity_id TEXT NOT NULL,
+                score REAL NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (day_type, hour, entity_id)
+            ) WITHOUT ROWID
+        ''')
+
+        # Histogram counts folded into months once they age out of usage_histogram
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS usage_monthly (
+                month TEXT NOT NULL,
+                minute_of_day INTEGER NOT NULL,
+                entity_id TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (month, minute_of_day, entity_id)
+            ) WITHOUT ROWID
+        ''')
+        db.commit()
+
+def _minute_distance(a, b):
+    """Minutes between two minutes of the day, going around midnight if shorter."""
+    distance = abs(a - b) % 1440
+    return min(distance, 1440 - distance)
+
+# Hour slots ranking each minute of the day: slot HH covers HH:30 +- 1h
+RANKING_SLOT_HOURS = [[hour for hour in range(24) if _minute_distance(minute, hour * 60 + 30) <= 60]
+                      for minute in range(1440)]
+
+def _ranking_day_type(day):
+    """Ranking partition of a date: 'weekday'/'weekend', or 'all' when not split."""
+    if not MOST_USED_SPLIT_WEEKENDS:
+        return 'all'
+    return 'weekend' if day.weekday() >= 5 else 'weekday'
+
+INSERT_USAGE_SQL = "INSERT INTO usage_log (entity_id, timestamp) VALUES (?, ?)"
+BUMP_HISTOGRAM_SQL = '''
+    INSERT INTO usage_histogram (day, minute_of_day, entity_id, count) VALUES (?, ?, ?, 1)
+    ON CONFLICT (day, minute_of_day, entity_id) DO UPDATE SET count = count + 1
+'''
+# A press today has weight 1 whatever the decay, so it just adds 1
+BUMP_SCORES_SQL = '''
+    INSERT INTO most_used_scores (day_type, hour, entity_id, score, count) VALUES (?, ?, ?, 1, 1)
+    ON CONFLICT (day_type, hour, entity_id) DO UPDATE SET score = score + 1, count = count + 1
+'''
+
+def record_usage(db, entries):
+    """
+    Log activations, given as (entity_id, UTC datetime) pairs, to usage_log and
+    bump their usage_histogram buckets and ranking scores in one transaction.
+    """
+    with _timed_query('record_usage'), db:
+        db.executemany(INSERT_USAGE_SQL, [(entity_id, ts.strftime('%Y-%m-%d %H:%M:%S')) for entity_id, ts in entries])
+        db.executemany(BUMP_HISTOGRAM_SQL,
+                       [(ts.strftime('%Y-%m-%d'), ts.hour * 60 + ts.minute, entity_id) for entity_id, ts in entries])
+        db.executemany(BUMP_SCORES_SQL, [(_ranking_day_type(ts.date()), hour, entity_id)
+                                         for entity_id, ts in entries
+                                         for hour in RANKING_SLOT_HOURS[ts.hour * 60 + ts.minute]])
+
 with app.app_context():
     init_db()
 
-def fetch_ha_data_rest(endpoint):
-    """Fetches data from Home Assistant REST API."""
-    try:
-        response = requests.get(f"{HA_URL}/api/{endpoint}", headers=HEADERS)
-        response.raise_for_status()
-        data = response.json()
-        if endpoint == 'config/area_registry' or endpoint == 'config/entity_registry':
-            app.logger.debug(f"HA REST API Response for {endpoint}: {data}") # Only debug log for specific endpoints
-        return data
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Error fetching data from Home Assistant REST API at {endpoint}: {e}")
+# Usage logging
+class UsageWriter:
+    """
+    Queues activations in memory and writes them from a single writer thread,
+    committing everything that piled up since the last write as one batch.
+    """
+    def __init__(self, pool, batch_size=500, max_attempts=5, retry_delay=0.5):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._listeners = []
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def add_listener(self, callback):
+        """Register a callback run after each batch is written."""
+        self._listeners.append(callback)
+
+    def record(self, entity_id):
+        """Queue an activation timestamped now."""
+        self.record_many([entity_id])
+
+    def record_many(self, entity_ids):
+        """Queue several activations timestamped now; they are written in the same transaction."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='usage-writer', daemon=True)
+                self._thread.start()
+        now = datetime.now(timezone.utc)
+        self._queue.put([(entity_id, now) for entity_id in entity_ids])
+
+    def _run(self):
+        db = self.pool.connection()
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = None in batch
+            entries = [entry for group in batch if group is not None for entry in group]
+            if entries:
+                if not self._write(db, entries):
+                    continue
+                for listener in self._listeners:
+                    try:
+                        listener()
+                    except Exception as e:
+                        app.logger.error(f"Error in usage writer listener: {e}")
+
+    def _write(self, db, entries):
+        """
+        Write a batch, retrying with backoff while the database is busy (a
+        ranking rebuild or retention run holding the write lock). Returns True
+        once written; the batch is only dropped after max_attempts.
+        """
+        delay = self.retry_delay
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                record_usage(db, entries)
+                return True
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    app.logger.error(f"Error writing {len(entries)} usage log entries, dropping them: {e}")
+                    return False
+                app.logger.warning(f"Error writing {len(entries)} usage log entries, retrying in {delay}s: {e}")
+                time.sleep(delay)
+                delay *= 2
+
+    def close(self):
+        """Write out queued activations; registered to run at exit."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+usage_writer = UsageWriter(usage_db)
+
+# Usage retention
+class UsageRetention:
+    """
+    Keeps data/usage.db from growing forever. Every activation is counted in
+    usage_histogram as it is logged, so raw usage_log rows past the retention
+    horizon carry no extra information for the ranking and are deleted.
+    Histogram days past their own horizon are folded into usage_monthly. All
+    deletes run in small batches, each its own short transaction, so the usage
+    writer is never locked out for long; freed pages are then returned with
+    incremental VACUUM.
+    """
+    def __init__(self, pool, log_days, histogram_days, interval, batch_size=5000, vacuum_pages=1000):
+        self.pool = pool
+        self.log_days = log_days
+        self.histogram_days = histogram_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._run_lock = threading.Lock()
+
+    def start(self):
+        """Start the retention thread if it is not already running."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='usage-retention', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            # With several worker processes, one run per interval is enough
+            if not SHARED_CACHE or shared_state.acquire('usage-retention', self.interval):
+                try:
+                    self._enable_incremental_vacuum(self.pool.connection())
+                    self.run_once()
+                except Exception as e:
+                    app.logger.error(f"Error applying usage retention: {e}")
+                finally:
+                    self.pool.release()
+            time.sleep(self.interval)
+
+    def run_once(self, now=None):
+        """Apply retention once. Returns (log rows deleted, histogram days folded, pages freed)."""
+        now = now or datetime.now(timezone.utc)
+        db = self.pool.connection()
+        with self._run_lock:
+            deleted = self._delete_old_log_rows(db, (now - timedelta(days=self.log_days)).strftime('%Y-%m-%d %H:%M:%S'))
+            folded = self._fold_old_histogram_days(db, (now - timedelta(days=self.histogram_days)).strftime('%Y-%m-%d'))
+            freed = self._incremental_vacuum(db)
+        if deleted or folded or freed:
+            app.logger.info(f"Usage retention: deleted {deleted} log rows, folded {folded} histogram days, freed {freed} pages")
+        return deleted, folded, freed
+
+    def _delete_old_log_rows(self, db, cutoff):
+        deleted = 0
+        while True:
+            with _timed_query('retention_delete_log'), db:
+                cursor = db.execute('''
+                    DELETE FROM usage_log WHERE id IN (
+                        SELECT id FROM usage_log WHERE timestamp < ? ORDER BY timestamp LIMIT ?
+                    )
+                ''', (cutoff, self.batch_size))
+            deleted += cursor.rowcount
+            if cursor.rowcount < self.batch_size:
+                return deleted
+            time.sleep(0.05)  # Let queued activation writes in between batches
+
+    def _fold_old_histogram_days(self, db, cutoff):
+        days = [row[0] for row in db.execute('SELECT DISTINCT day FROM usage_histogram WHERE day < ?', (cutoff,))]
+        for day in days:
+            # One day per transaction keeps each write lock short
+            with _timed_query('retention_fold_histogram'), db:
+                db.execute('''
+                    INSERT INTO usage_monthly (month, minute_of_day, entity_id, count)
+                    SELECT SUBSTR(day, 1, 7), minute_of_day, entity_id, SUM(count)
+                    FROM usage_histogram
+                    WHERE day = ?
+                    GROUP BY minute_of_day, entity_id
+                    ON CONFLICT (month, minute_of_day, entity_id) DO UPDATE SET count = count + excluded.count
+                ''', (day,))
+                db.execute('DELETE FROM usage_histogram WHERE day = ?', (day,))
+        return len(days)
+
+    def _enable_incremental_vacuum(self, db):
+        """
+        Switch the database to auto_vacuum=INCREMENTAL so freed pages can be
+        returned a few at a time. An existing database needs one full VACUUM for
+        that, so it runs here, in one process, rather than at import in every worker.
+        """
+        if db.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return
+        app.logger.info("Converting usage database to incremental auto-vacuum")
+        with _timed_query('retention_convert_vacuum'):
+            db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            db.execute('VACUUM')
+
+    def _incremental_vacuum(self, db):
+        if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0
+        freed = 0
+        free_pages = db.execute('PRAGMA freelist_count').fetchone()[0]
+        while free_pages:
+            with _timed_query('retention_vacuum'):
+                db.execute(f'PRAGMA incremental_vacuum({self.vacuum_pages})').fetchall()
+            remaining = db.execute('PRAGMA freelist_count').fetchone()[0]
+            if remaining >= free_pages:
+                break
+            freed += free_pages - remaining
+            free_pages = remaining
+            time.sleep(0.05)
+        return freed
+
+usage_retention = UsageRetention(usage_db, USAGE_RETENTION_DAYS, HISTOGRAM_RETENTION_DAYS, USAGE_RETENTION_INTERVAL)
+usage_retention.start()
+
+# Most-used ranking
+class RankingEngine:
+    """
+    Precomputes the most-used ranking of all 24 hour slots into most_used_scores
+    in a single pass over usage_histogram, so no visitor pays for a scan.
+    Scores can decay with age and be kept apart for weekdays and weekends.
+    record_usage bumps the scores as activations are logged; the periodic
+    rebuild re-applies decay and drops days that left the window.
+    """
+    def __init__(self, pool, days, half_life_days, interval):
+        self.pool = pool
+        self.days = days
+        self.half_life_days = half_life_days
+        self.interval = interval
+        self._listeners = []
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def add_listener(self, callback):
+        """Register a callback run after every rebuild."""
+        self._listeners.append(callback)
+
+    def start(self):
+        """Start the rebuild thread if it is not already running."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ranking-rebuild', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            # With several worker processes, one rebuild per interval is enough
+            if not SHARED_CACHE or shared_state.acquire('most-used-ranking', self.interval):
+                try:
+                    self.rebuild()
+                    for listener in self._listeners:
+                        listener()
+                except Exception as e:
+                    app.logger.error(f"Error rebuilding most used rankings: {e}")
+                finally:
+                    self.pool.release()
+            time.sleep(self.interval)
+
+    def _weight(self, age_days):
+        return 0.5 ** (age_days / self.half_life_days) if self.half_life_days else 1.0
+
+    def rebuild(self, now=None):
+        """Recompute every slot's scores. Returns the number of score rows written."""
+        now = now or datetime.now(timezone.utc)  # Histogram days are UTC dates
+        today = now.date()
+        cutoff = (now - timedelta(days=self.days)).strftime('%Y-%m-%d')
+        db = self.pool.connection()
+
+        with _timed_query('ranking_rebuild'):
+            # Hold the write lock from the read on, so no activation is lost in between
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                scores = {}
+                days = {}  # day -> (day_type, weight)
+                for day, minute, entity_id, count in db.execute(
+                        'SELECT day, minute_of_day, entity_id, count FROM usage_histogram WHERE day >= ?', (cutoff,)):
+                    if day not in days:
+                        date = datetime.strptime(day, '%Y-%m-%d').date()
+                        days[day] = (_ranking_day_type(date), self._weight(max((today - date).days, 0)))
+                    day_type, weight = days[day]
+                    for hour in RANKING_SLOT_HOURS[minute]:
+                        entry = scores.setdefault((day_type, hour, entity_id), [0.0, 0])
+                        entry[0] += count * weight
+                        entry[1] += count
+
+                db.execute('DELETE FROM most_used_scores')
+                db.executemany('INSERT INTO most_used_scores (day_type, hour, entity_id, score, count) VALUES (?, ?, ?, ?, ?)',
+                               [(*key, score, count) for key, (score, count) in scores.items()])
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+        app.logger.debug("Rebuilt most used rankings: %s scores over %s days", len(scores), len(days))
+        return len(scores)
+
+ranking_engine = RankingEngine(usage_db, MOST_USED_DAYS, MOST_USED_HALF_LIFE_DAYS, MOST_USED_REFRESH_INTERVAL)
+
+# Home Assistant REST client
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures. While open, calls are refused
+    immediately; after `cooldown` seconds a single trial call is let through and
+    its outcome closes or re-opens the circuit.
+    """
+    def __init__(self, threshold=3, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if not self._trial_in_flight and time.monotonic() - self._opened_at >= self.cooldown:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                app.logger.info("Home Assistant reachable again, closing circuit")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._failures >= self.threshold:
+                if self._opened_at is None:
+                    app.logger.warning(f"Home Assistant unreachable after {self._failures} failures, opening circuit for {self.cooldown}s")
+                self._opened_at = time.monotonic()
+
+# Shared, connection-pooled session for all REST calls
+ha_session = requests.Session()
+ha_session.headers.update(HEADERS)
+ha_session.mount('http://', HTTPAdapter(pool_maxsize=10))
+ha_session.mount('https://', HTTPAdapter(pool_maxsize=10))
+ha_breaker = CircuitBreaker(HA_BREAKER_THRESHOLD, HA_BREAKER_COOLDOWN)
+HA_TIMEOUT = (HA_CONNECT_TIMEOUT, HA_READ_TIMEOUT)
+
+def _is_upstream_failure(e):
+    """Connection problems, timeouts and 5xx count against HA; 4xx do not."""
+    response = getattr(e, 'response', None)
+    return response is None or response.status_code >= 500
+
+def _iter_json_array(chunks):
+    """
+    Incrementally decode a JSON array from an iterable of byte chunks, yielding
+    one element at a time so the full document is never held in memory.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf, pos = '', 0
+    started = exhausted = False
+
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError('Expected a JSON array')
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                element, pos = decoder.raw_decode(buf, pos)
+                yield element
+                continue
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+        elif exhausted:
+            raise ValueError('Unexpected end of JSON array')
+
+        # Need more data to complete the next element
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buf = buf[pos:] + text_decoder.decode(b'', final=True)
+        else:
+            buf = buf[pos:] + text_decoder.decode(chunk)
+        pos = 0
+
+def _ha_rest_get(endpoint, parse, stream=False):
+    """
+    GETs an endpoint of the Home Assistant REST API and returns parse(response).
+    Retries upstream failures with jittered backoff and returns None straight
+    away while the circuit breaker is open.
+    """
+    if not ha_breaker.allow():
+        app.logger.debug("Circuit open, skipping Home Assistant REST fetch of %s", endpoint)
         return None
 
+    for attempt in range(HA_READ_RETRIES + 1):
+        try:
+            with _timed_ha_call('rest', endpoint), \
+                    ha_session.get(f"{HA_URL}/api/{endpoint}", timeout=HA_TIMEOUT, stream=stream) as response:
+                response.raise_for_status()
+                data = parse(response)
+            ha_breaker.record_success()
+            return data
+        except requests.exceptions.RequestException as e:
+            if not _is_upstream_failure(e):
+                ha_breaker.record_success()  # HA answered, just not with data
+                app.logger.error(f"Error fetching data from Home Assistant REST API at {endpoint}: {e}")
+                return None
+            if attempt < HA_READ_RETRIES and not ha_breaker.is_open:
+                delay = random.uniform(0, 0.5 * 2 ** attempt)
+                app.logger.warning(f"Retrying Home Assistant REST fetch of {endpoint} in {delay:.2f}s: {e}")
+                time.sleep(delay)
+                continue
+            app.logger.error(f"Error fetching data from Home Assistant REST API at {endpoint}: {e}")
+            ha_breaker.record_failure()
+            return None
+        except ValueError as e:
+            ha_breaker.record_success()  # HA answered, just not with data
+            app.logger.error(f"Invalid response from Home Assistant REST API at {endpoint}: {e}")
+            return None
+
+def fetch_ha_states(prefixes):
+    """
+    Fetches the states of entities whose id starts with one of `prefixes`.
+    /api/states is streamed and decoded one entity at a time, discarding
+    non-matching entities on the fly, so memory scales with the matches
+    rather than with the whole install.
+    """
+    def parse(response):
+        return [state for state in _iter_json_array(response.iter_content(chunk_size=65536))
+                if state.get('entity_id', '').startswith(prefixes)]
+    return _ha_rest_get('states', parse, stream=True)
+
 def call_ha_service(domain, service, entity_id):
-    """Calls a service on Home Assistant REST API."""
+    """Calls a service on Home Assistant REST API. Not retried, as it is not idempotent."""
+    if not ha_breaker.allow():
+        app.logger.error(f"Circuit open, not calling Home Assistant service {domain}.{service} for {entity_id}")
+        return None
+
     try:
         data = {"entity_id": entity_id}
-        response = requests.post(f"{HA_URL}/api/services/{domain}/{service}", headers=HEADERS, json=data)
-        response.raise_for_status()
+        with _timed_ha_call('rest', f'services/{domain}/{service}'):
+            response = ha_session.post(f"{HA_URL}/api/services/{domain}/{service}", json=data, timeout=HA_TIMEOUT)
+            response.raise_for_status()
+        ha_breaker.record_success()
         return response.json()
     except requests.exceptions.RequestException as e:
         app.logger.error(f"Error calling Home Assistant service {domain}.{service} for {entity_id}: {e}")
+        if _is_upstream_failure(e):
+            ha_breaker.record_failure()
+        else:
+            ha_breaker.record_success()  # HA answered, just refused the call
         return None
 
+def activate_service(entity_id, service='turn_on'):
+    """
+    Calls a service for one entity, like activate_services() does for several.
+    Returns True on success.
+    """
+    return activate_services([entity_id], service)[entity_id]
+
+def activate_services(entity_ids, service='turn_on'):
+    """
+    Calls a service for several entities at once: every command is sent over
+    the WebSocket session before any result is awaited, so Home Assistant runs
+    them concurrently. Entities whose command could not be sent fall back to
+    REST; a command that was sent is never re-issued, as it is not idempotent.
+    Returns {entity_id: True on success}.
+    """
+    results = {}
+    sent = {}
+    fallback = []
+    for entity_id in entity_ids:
+        domain = entity_id.split('.')[0]
+        try:
+            sent[entity_id] = ha_ws.send('call_service', domain=domain, service=service, target={'entity_id': entity_id})
+        except ConnectionError:
+            fallback.append(entity_id)
+        except Exception as e:
+            # A TLS error or stalled write means the command never went out
+            app.logger.warning(f"WebSocket send failed for {domain}.{service} of {entity_id}: {e}")
+            fallback.append(entity_id)
+
+    wait_for_futures(sent.values(), timeout=ha_ws.timeout)
+    for entity_id, future in sent.items():
+        domain = entity_id.split('.')[0]
+        if future.cancel():
+            app.logger.error(f"Timed out calling Home Assistant service {domain}.{service} for {entity_id}")
+            results[entity_id] = False
+            continue
+        try:
+            future.result()
+            results[entity_id] = True
+        except ConnectionError as e:
+            # The command already went out and may have run: re-sending it over REST could run it twice
+            app.logger.error(f"Lost the result of Home Assistant service {domain}.{service} for {entity_id}: {e}")
+            results[entity_id] = False
+        except Exception as e:
+            app.logger.error(f"Error calling Home Assistant service {domain}.{service} for {entity_id}: {e}")
+            results[entity_id] = False
+
+    if fallback:
+        app.logger.warning(f"WebSocket unavailable for {service} of {len(fallback)} entities, falling back to REST")
+        # Never on _activation_executor: _run_activations would wait on jobs queued behind it
+        calls = [_fallback_executor.submit(call_ha_service, entity_id.split('.')[0], service, entity_id)
+                 for entity_id in fallback]
+        for entity_id, call in zip(fallback, calls):
+            results[entity_id] = call.result() is not None
+    return results
+
+# Activation status by activation_id, most recent last
+_activations = OrderedDict()
+_activations_lock = threading.Lock()
+_activation_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='ha-service')
+_fallback_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='ha-rest-fallback')
+MAX_TRACKED_ACTIVATIONS = 200
+
+def _set_activation_status(activation_id, status):
+    if SHARED_CACHE:
+        # The status poll may land on any worker process
+        try:
+            shared_state.set_activation_status(activation_id, status)
+        except Exception as e:
+            app.logger.error(f"Error storing activation status: {e}")
+        return
+    with _activations_lock:
+        _activations[activation_id] = status
+        _activations.move_to_end(activation_id)
+        while len(_activations) > MAX_TRACKED_ACTIVATIONS:
+            _activations.popitem(last=False)
+
+def _get_activation_status(activation_id):
+    if SHARED_CACHE:
+        return shared_state.get_activation_status(activation_id)
+    with _activations_lock:
+        return _activations.get(activation_id)
+
+# Debouncing: entity_id -> (expiry, activation_id) of its last accepted activation
+_recent_activations = {}
+_recent_activations_lock = threading.Lock()
+
+def _claim_activations(claims):
+    if SHARED_CACHE:
+        # A double tap may land on two different worker processes
+        return shared_state.claim_activations(claims, ACTIVATION_DEBOUNCE_SECONDS)
+    now = time.monotonic()
+    with _recent_activations_lock:
+        for entity_id, (expires, _) in list(_recent_activations.items()):
+            if expires <= now:
+                del _recent_activations[entity_id]
+        for entity_id, activation_id in claims.items():
+            _recent_activations.setdefault(entity_id, (now + ACTIVATION_DEBOUNCE_SECONDS, activation_id))
+        return {entity_id: _recent_activations[entity_id][1] for entity_id in claims}
+
+def _release_activation(entity_id, activation_id):
+    if SHARED_CACHE:
+        shared_state.release_activation(entity_id, activation_id)
+        return
+    with _recent_activations_lock:
+        if _recent_activations.get(entity_id, (None, None))[1] == activation_id:
+            del _recent_activations[entity_id]
+
+def claim_activations(entity_ids):
+    """
+    Start an activation of each entity, unless it was activated within the last
+    ACTIVATION_DEBOUNCE_SECONDS. Returns entity_id -> (activation_id, is_new):
+    new activations start out 'pending'; repeats get the earlier activation,
+    whose status tells how that call went.
+    """
+    claims = {entity_id: uuid.uuid4().hex for entity_id in entity_ids}
+    held = claims
+    if ACTIVATION_DEBOUNCE_SECONDS > 0:
+        try:
+            held = _claim_activations(claims)
+        except Exception as e:
+            app.logger.error(f"Error debouncing activations: {e}")
+    for entity_id, activation_id in claims.items():
+        if held[entity_id] == activation_id:
+            _set_activation_status(activation_id, 'pending')
+    return {entity_id: (held[entity_id], held[entity_id] == claims[entity_id]) for entity_id in entity_ids}
+
+def finish_activation(entity_id, activation_id, success):
+    """Record an activation's outcome; a failed one no longer debounces retries."""
+    if not success and ACTIVATION_DEBOUNCE_SECONDS > 0:
+        try:
+            _release_activation(entity_id, activation_id)
+        except Exception as e:
+            app.logger.error(f"Error releasing debounced activation: {e}")
+    _set_activation_status(activation_id, 'success' if success else 'failed')
+
+def _run_activations(activations, service):
+    """Activate {entity_id: activation_id} together and record each outcome."""
+    results = {}
+    try:
+        results = activate_services(list(activations), service)
+    except Exception as e:
+        app.logger.error(f"Error activating {len(activations)} entities: {e}")
+    finally:
+        # Never leave an activation 'pending' for its status poll
+        for entity_id, activation_id in activations.items():
+            results.setdefault(entity_id, False)
+            finish_activation(entity_id, activation_id, results[entity_id])
+    return results
+
+def start_activations(activations, service='turn_on'):
+    """Run the service calls for {entity_id: activation_id} in the background."""
+    _activation_executor.submit(_run_activations, activations, service)
+
 def get_all_scripts_and_scenes():
     """
     Fetches all scripts and scenes, and their associated area_ids using WebSocket API.
     Combines data from states and entity registry.
-    Uses cache-first approach with background refresh.
+    Uses cache-first approach; the cache is kept current by HA events while the
+    WebSocket session is live and refreshed in the background otherwise.
     """
+    ha_ws.start()
     cache_key = 'scripts_and_scenes'
     cached_data = data_cache.get(cache_key)
     
     # Return cached data if available
     if cached_data is not None:
         app.logger.debug("Returning cached scripts and scenes data")
-        # Start background refresh if cache is stale
-        if data_cache.is_stale(cache_key):
-            threading.Thread(target=_refresh_scripts_and_scenes_cache, daemon=True).start()
+        # Start background refresh if cache is stale and no events are flowing
+        if not ha_ws.live and data_cache.is_stale(cache_key):
+            single_flight.submit(cache_key, _refresh_scripts_and_scenes_cache)
         return cached_data
     
-    # No cache available, fetch immediately
+    # No cache available, fetch immediately (joining any fetch already in flight)
     app.logger.debug("No cache available, fetching scripts and scenes immediately")
-    entities = _fetch_scripts_and_scenes()
-    data_cache.set(cache_key, entities)
-    return entities
+    entities = single_flight.do(cache_key, _refresh_scripts_and_scenes_cache)
+    return entities if entities is not None else []  # HA unavailable
+
+def _fetch_entity_area_map():
+    """
+    Maps script/scene entity ids to their registry area_id. Uses the compact
+    list_for_display registry listing where available (HA 2023.3+).
+    """
+    try:
+        er_res = ha_ws.call('config/entity_registry/list_for_display')
+        entries = ((entry.get('ei'), entry.get('ai')) for entry in (er_res or {}).get('entities', []))
+    except RuntimeError:
+        er_res = ha_ws.call('config/entity_registry/list')
+        entries = ((entry.get('entity_id'), entry.get('area_id')) for entry in er_res or [])
+
+    # Ensure entity_id exists and only keep what the dashboard shows
+    return {eid: aid for eid, aid in entries if eid and eid.startswith(TRACKED_DOMAINS)}
 
 def _fetch_scripts_and_scenes():
-    """Internal function to fetch scripts and scenes from Home Assistant."""
-    all_states = fetch_ha_data_rest('states')
-    if all_states is None:
+    """Internal function to fetch scripts and scenes from Home Assistant. Returns None if HA is unavailable."""
+    states = fetch_ha_states(TRACKED_DOMAINS)
+    if states is None:
         app.logger.debug("No states data fetched from HA.")
-        return []
-
-    # Determine WebSocket URL
-    parsed = urlparse(HA_URL)
-    ws_scheme = 'wss' if parsed.scheme == 'https' else 'ws'
-    ws_url = f"{ws_scheme}://{parsed.netloc}/api/websocket"
+        return None
 
     entity_area_map = {}
-    
-    try:
-        ws = websocket.create_connection(ws_url)
-        
-        # Receive auth_required
-        auth_req = json.loads(ws.recv())
-        if auth_req.get('type') != 'auth_required':
-            app.logger.error(f"Unexpected WS response during auth_required: {auth_req.get('type', '')}")
-            raise RuntimeError('Unexpected WS response during auth_required.')
-
-        # Authenticate
-        ws.send(json.dumps({'type': 'auth', 'access_token': HA_TOKEN}))
-        auth_res = json.loads(ws.recv())
-        if auth_res.get('type') != 'auth_ok':
-            app.logger.error(f"WS authentication failed: {auth_res.get('message', '')}")
-            raise RuntimeError('WS auth failed.')
-
-        # Request entity registry
-        ws.send(json.dumps({'id': 1, 'type': 'config/entity_registry/list'}))
-        er_res = json.loads(ws.recv())
-        app.logger.debug(f"HA WS Entity Registry Response: {er_res}")
-        
-        for entry in er_res.get('result', []):
-            eid = entry.get('entity_id')
-            if eid: # Ensure entity_id exists
-                entity_area_map[eid] = entry.get('area_id')
 
-        ws.close()
+    try:
+        entity_area_map = _fetch_entity_area_map()
+        # Remember registry areas of scripts/scenes for live updates
+        with _live_lock:
+            _entity_area_ids.clear()
+            _entity_area_ids.update(entity_area_map)
     except Exception as e:
         app.logger.error(f"WebSocket error during entity/area registry fetch: {e}")
         # Proceed with potentially incomplete maps if WebSocket fails
 
-    app.logger.debug(f"Entity Area Map from WS Registry: {entity_area_map}") # Keep this debug log
+    app.logger.debug("Entity Area Map from WS Registry: %s", entity_area_map) # Keep this debug log
 
     entities = []
-    for state_entity in all_states:
+    for state_entity in states:
         entity_id = state_entity['entity_id']
-        if entity_id.startswith(('script.', 'scene.')):
-            name = state_entity['attributes'].get('friendly_name', entity_id)
-            area_id = entity_area_map.get(entity_id) # Get area_id from the WebSocket-fetched map
+        name = state_entity['attributes'].get('friendly_name', entity_id)
+        area_id = entity_area_map.get(entity_id) # Get area_id from the WebSocket-fetched map
 
-            entities.append({
-                'entity_id': entity_id,
-                'name': name,
-                'area_id': area_id
-            })
-    app.logger.debug(f"Processed Scripts and Scenes with Areas: {entities}") # Keep this debug log
+        entities.append({
+            'entity_id': entity_id,
+            'name': name,
+            'area_id': area_id
+        })
+    app.logger.debug("Processed Scripts and Scenes with Areas: %s", entities) # Keep this debug log
     return entities
 
 def _refresh_scripts_and_scenes_cache():
-    """Background thread function to refresh scripts and scenes cache."""
+    """Refreshes the scripts and scenes cache. Returns the entities, or None if the fetch failed."""
     try:
-        app.logger.debug("Background refresh of scripts and scenes cache started")
+        app.logger.debug("Refresh of scripts and scenes cache started")
         entities = _fetch_scripts_and_scenes()
+        if entities is None:
+            app.logger.debug("Refresh of scripts and scenes skipped, HA unavailable")
+            return None
         data_cache.set('scripts_and_scenes', entities)
-        app.logger.debug("Background refresh of scripts and scenes cache completed")
+        app.logger.debug("Refresh of scripts and scenes cache completed")
+        return entities
     except Exception as e:
-        app.logger.error(f"Error during background refresh of scripts and scenes: {e}")
+        app.logger.error(f"Error during refresh of scripts and scenes: {e}")
+        return None
 
 def get_areas():
     """
     Fetches areas from Home Assistant WebSocket API.
-    Uses cache-first approach with background refresh.
+    Uses cache-first approach; the cache is kept current by HA events while the
+    WebSocket session is live and refreshed in the background otherwise.
     """
+    ha_ws.start()
     cache_key = 'areas'
     cached_data = data_cache.get(cache_key)
     
     # Return cached data if available
     if cached_data is not None:
         app.logger.debug("Returning cached areas data")
-        # Start background refresh if cache is stale
-        if data_cache.is_stale(cache_key):
-            threading.Thread(target=_refresh_areas_cache, daemon=True).start()
+        # Start background refresh if cache is stale and no events are flowing
+        if not ha_ws.live and data_cache.is_stale(cache_key):
+            single_flight.submit(cache_key, _refresh_areas_cache)
         return cached_data
     
-    # No cache available, fetch immediately
+    # No cache available, fetch immediately (joining any fetch already in flight)
     app.logger.debug("No cache available, fetching areas immediately")
-    areas_map = _fetch_areas()
-    data_cache.set(cache_key, areas_map)
-    return areas_map
+    areas_map = single_flight.do(cache_key, _refresh_areas_cache)
+    return areas_map if areas_map is not None else {}  # HA unavailable
 
 def _fetch_areas():
-    """Internal function to fetch areas from Home Assistant."""
-    # Determine WebSocket URL
-    parsed = urlparse(HA_URL)
-    ws_scheme = 'wss' if parsed.scheme == 'https' else 'ws'
-    ws_url = f"{ws_scheme}://{parsed.netloc}/api/websocket"
-
+    """Internal function to fetch areas from Home Assistant. Returns None if HA is unavailable."""
     areas_map = {}
-    
+
     try:
-        ws = websocket.create_connection(ws_url)
-        
-        # Receive auth_required
-        auth_req = json.loads(ws.recv())
-        if auth_req.get('type') != 'auth_required':
-            app.logger.error(f"Unexpected WS response during auth_required: {auth_req.get('type', '')}")
-            raise RuntimeError('Unexpected WS response during auth_required.')
-
-        # Authenticate
-        ws.send(json.dumps({'type': 'auth', 'access_token': HA_TOKEN}))
-        auth_res = json.loads(ws.recv())
-        if auth_res.get('type') != 'auth_ok':
-            app.logger.error(f"WS authentication failed: {auth_res.get('message', '')}")
-            raise RuntimeError('WS auth failed.')
-
-        # Request area registry
-        ws.send(json.dumps({'id': 1, 'type': 'config/area_registry/list'}))
-        ar_res = json.loads(ws.recv())
-        app.logger.debug(f"HA WS Area Registry Response: {ar_res}")
-        
-        for area in ar_res.get('result', []):
+        ar_res = ha_ws.call('config/area_registry/list')
+        app.logger.debug("HA WS Area Registry Response: %s", ar_res)
+
+        for area in ar_res or []:
             aid = area.get('area_id')
             name = area.get('name') or 'Unnamed Area'
             areas_map[aid] = name
-
-        ws.close()
     except Exception as e:
         app.logger.error(f"WebSocket error during area registry fetch: {e}")
-        # Proceed with empty areas_map if WebSocket fails
+        return None
 
-    app.logger.debug(f"Processed Areas Map: {areas_map}") # Keep this debug log
+    app.logger.debug("Processed Areas Map: %s", areas_map) # Keep this debug log
     return areas_map
 
 def _refresh_areas_cache():
-    """Background thread function to refresh areas cache."""
+    """Refreshes the areas cache. Returns the areas map, or None if the fetch failed."""
     try:
-        app.logger.debug("Background refresh of areas cache started")
+        app.logger.debug("Refresh of areas cache started")
         areas_map = _fetch_areas()
+        if areas_map is None:
+            app.logger.debug("Refresh of areas skipped, HA unavailable")
+            return None
         data_cache.set('areas', areas_map)
-        app.logger.debug("Background refresh of areas cache completed")
+        app.logger.debug("Refresh of areas cache completed")
+        return areas_map
     except Exception as e:
-        app.logger.error(f"Error during background refresh of areas: {e}")
+        app.logger.error(f"Error during refresh of areas: {e}")
+        return None
 
-@app.route('/')
-def home():
-    all_entities = get_all_scripts_and_scenes()
-    areas_map = get_areas()
+# Live updates from Home Assistant events
+_entity_area_ids = {}  # Registry area_id per script/scene, kept current by events
+_live_lock = threading.Lock()
+
+def _patch_cached_entity(entity_id, remove=False, **fields):
+    """Apply an incremental change to the cached scripts_and_scenes list."""
+    with _live_lock:
+        entities = data_cache.get('scripts_and_scenes')
+        if entities is None:
+            return  # Nothing cached yet, the next read does a full fetch
 
-    # Keep these debug logs for diagnosing area display
-    app.logger.debug(f"Home Route - All Entities: {all_entities}")
-    app.logger.debug(f"Home Route - Areas Map: {areas_map}")
+        # Copy-on-write so readers never see a list being mutated
+        patched = []
+        found = False
+        for entity in entities:
+            if entity['entity_id'] != entity_id:
+                patched.append(entity)
+                continue
+            found = True
+            if not remove:
+                patched.append(dict(entity, **fields))
 
-    # Group entities by area
-    entities_by_area = {"other": []} # "other" for entities without an area_id or unmapped area_id
-    for area_id in areas_map:
-        entities_by_area[area_id] = []
+        if not found:
+            if remove or 'name' not in fields:
+                return  # Only a state can introduce a new entity
+            patched.append(dict({'entity_id': entity_id, 'area_id': _entity_area_ids.get(entity_id)}, **fields))
 
-    for entity in all_entities:
-        area_id = entity.get('area_id')
-        if area_id and area_id in entities_by_area:
-            entities_by_area[area_id].append(entity)
+        if patched != entities:
+            data_cache.set('scripts_and_scenes', patched)
+            app.logger.debug("Patched cached entity %s: %s", entity_id, 'removed' if remove else fields)
+
+def _on_state_changed(event):
+    data = event.get('data') or {}
+    entity_id = data.get('entity_id') or ''
+    if not entity_id.startswith(TRACKED_DOMAINS):
+        return
+
+    new_state = data.get('new_state')
+    if new_state is None:
+        _patch_cached_entity(entity_id, remove=True)
+    else:
+        name = (new_state.get('attributes') or {}).get('friendly_name', entity_id)
+        _patch_cached_entity(entity_id, name=name)
+
+def _on_entity_registry_updated(event):
+    data = event.get('data') or {}
+    entity_id = data.get('entity_id') or ''
+    if not entity_id.startswith(TRACKED_DOMAINS):
+        return
+
+    action = data.get('action')
+    if action == 'remove':
+        area_id = None
+    elif action == 'update' and 'area_id' not in (data.get('changes') or {}):
+        return  # Renames are picked up through state_changed
+    else:
+        entry = ha_ws.call('config/entity_registry/get', entity_id=entity_id) or {}
+        area_id = entry.get('area_id')
+
+    with _live_lock:
+        _entity_area_ids[entity_id] = area_id
+    _patch_cached_entity(entity_id, area_id=area_id)
+
+def _on_area_registry_updated(event):
+    data = event.get('data') or {}
+    area_id = data.get('area_id')
+
+    with _live_lock:
+        areas_map = data_cache.get('areas')
+        if areas_map is None:
+            return
+
+        patched = dict(areas_map)
+        if data.get('action') == 'remove':
+            patched.pop(area_id, None)
         else:
-            entities_by_area["other"].append(entity)
-    app.logger.debug(f"Home Route - Entities by Area: {entities_by_area}") # Keep this debug log
-
-    # Prepare areas for display
-    display_areas = []
-    if entities_by_area["other"]:
-        display_areas.append({"area_id": "other", "name": "Other"})
-
-    # Sort actual areas by name and add them if they contain entities
-    sorted_area_names = sorted([name for id, name in areas_map.items()])
-    for area_name in sorted_area_names:
-        for area_id, name in areas_map.items():
-            if name == area_name and entities_by_area.get(area_id):
+            for area in ha_ws.call('config/area_registry/list') or []:
+                if area.get('area_id') == area_id:
+                    patched[area_id] = area.get('name') or 'Unnamed Area'
+
+        if patched != areas_map:
+            data_cache.set('areas', patched)
+            app.logger.debug("Patched cached area %s", area_id)
+
+def _on_ha_connected():
+    """Resync after a (re)connect, since events may have been missed while down."""
+    if data_cache.get('scripts_and_scenes') is not None:
+        single_flight.do('scripts_and_scenes', _refresh_scripts_and_scenes_cache, force=True)
+    if data_cache.get('areas') is not None:
+        single_flight.do('areas', _refresh_areas_cache, force=True)
+
+ha_ws.subscribe_events('state_changed', _on_state_changed)
+ha_ws.subscribe_events('entity_registry_updated', _on_entity_registry_updated)
+ha_ws.subscribe_events('area_registry_updated', _on_area_registry_updated)
+ha_ws.add_connect_listener(_on_ha_connected)
+
+EVENT_LEASE_TTL = 30
+
+def _follow_events_if_leader():
+    """
+    With a shared cache, keep one worker process subscribed to HA events: each
+    process keeps trying to take or renew the event lease, and follows events
+    only while it holds it. The others see the patched entries via cache sync.
+    """
+    while True:
+        try:
+            is_leader = shared_state.acquire('ha-events', EVENT_LEASE_TTL)
+        except Exception as e:
+            app.logger.error(f"Error renewing the event lease: {e}")
+            is_leader = False
+        if is_leader and not ha_ws.events_enabled:
+            app.logger.info("This worker now follows Home Assistant events")
+        ha_ws.set_events_enabled(is_leader)
+        if is_leader:
+            ha_ws.start()
+        time.sleep(EVENT_LEASE_TTL / 3)
+
+if SHARED_CACHE:
+    ha_ws.set_events_enabled(False)
+    threading.Thread(target=_follow_events_if_leader, name='event-lease', daemon=True).start()
+    atexit.register(shared_state.release, 'ha-events')  # Hand over without waiting for expiry
+
+# Dashboard view model
+class DashboardSnapshot:
+    """
+    Immutable dashboard view model shared by home() and api_data(): entities
+    grouped and sorted per area, the areas to display in order, and the
+    serialized JSON body with its ETag, all computed once per data change.
+    Treat every attribute as read-only.
+    """
+    def __init__(self, version, all_entities, areas_map, most_used):
+        self.version = version
+
+        # Group entities by area
+        entities_by_area = {"other": []} # "other" for entities without an area_id or unmapped area_id
+        for area_id in areas_map:
+            entities_by_area[area_id] = []
+
+        for entity in all_entities:
+            area_id = entity.get('area_id')
+            if area_id and area_id in entities_by_area:
+                entities_by_area[area_id].append(entity)
+            else:
+                entities_by_area["other"].append(entity)
+
+        # Sort entities within each area
+        for entities in entities_by_area.values():
+            entities.sort(key=lambda x: x['name'].lower())
+
+        # Prepare areas for display: "Other" first, then areas with entities sorted by name
+        display_areas = []
+        if entities_by_area["other"]:
+            display_areas.append({"area_id": "other", "name": "Other"})
+        for area_id, name in sorted(areas_map.items(), key=lambda item: item[1]):
+            if entities_by_area[area_id]:
                 display_areas.append({"area_id": area_id, "name": name})
-                break
-    app.logger.debug(f"Home Route - Display Areas: {display_areas}") # Keep this debug log
 
-    # Get most used scripts/scenes
-    most_used = get_most_used_entities()
-    app.logger.debug(f"Home Route - Most Used Entities: {most_used}") # Keep this debug log
+        self.most_used = most_used
+        self.areas = display_areas
+        self.entities_by_area = entities_by_area
+        self.areas_map = areas_map
+        self.data = {
+            'most_used': most_used,
+            'areas': display_areas,
+            'entities_by_area': entities_by_area,
+            'areas_map': areas_map
+        }
+        self.body = app.json.dumps(self.data)
+        self.etag = hashlib.sha1(self.body.encode()).hexdigest()
+        # Same payload, escaped for embedding in the page's <script> tag
+        self.html_json = htmlsafe_json_dumps(self.data, dumps=app.json.dumps)
+
+_snapshot = None
+_snapshot_sources = ()
+_snapshot_lock = threading.Lock()
+
+def get_dashboard_snapshot():
+    """
+    Returns the current DashboardSnapshot, rebuilding it only when one of its
+    inputs changed. Cached inputs are replaced rather than mutated, so an
+    identity check is enough to detect changes.
+    """
+    global _snapshot, _snapshot_sources
+    sources = (get_all_scripts_and_scenes(), get_areas(), get_most_used_entities())
+    with _snapshot_lock:
+        rebuilt = _snapshot is None or any(new is not old for new, old in zip(sources, _snapshot_sources))
+        if rebuilt:
+            with _profile_stage('grouping'):
+                _snapshot = DashboardSnapshot((_snapshot.version + 1) if _snapshot else 1, *sources)
+            _snapshot_sources = sources
+            app.logger.debug("Built dashboard snapshot version %s", _snapshot.version)
+        snapshot = _snapshot
+    if rebuilt and sources[0]:
+        # Kept as the fallback served while the next process warms up
+        all_entities, areas_map, most_used = sources
+        data_cache.set('last_good_snapshot', {'entities': all_entities, 'areas_map': areas_map, 'most_used': most_used})
+    return snapshot
+
+# Last known good snapshot, built once per stored value: (stored value, snapshot)
+_last_good = (None, None)
+
+def _last_good_snapshot():
+    """DashboardSnapshot of the last known good data, or None if there is none."""
+    global _last_good
+    saved = data_cache.get('last_good_snapshot')
+    if saved is None:
+        return None
+    source, snapshot = _last_good
+    if source is not saved:
+        snapshot = DashboardSnapshot(0, saved['entities'], saved['areas_map'], saved['most_used'])
+        _last_good = (saved, snapshot)
+    return snapshot
+
+def get_serving_snapshot():
+    """
+    The snapshot to serve a request from. Until warm-up has filled the caches,
+    requests get the last known good snapshot instead of waiting for Home
+    Assistant; with nothing to fall back on they wait like before.
+    """
+    if not warm_up.ready and (data_cache.get('scripts_and_scenes') is None or data_cache.get('areas') is None):
+        snapshot = _last_good_snapshot()
+        if snapshot is not None:
+            return snapshot
+    return get_dashboard_snapshot()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        HTTP_REQUEST_SECONDS.labels(route, request.method, response.status_code).observe(time.perf_counter() - started)
+    return response
+
+@app.before_request
+def start_profiling():
+    if not PROFILING:
+        return
+    mode = request.headers.get('X-Profile') or request.args.get('profile')
+    if mode not in ('1', 'cprofile'):
+        return
+    g.profile_stages = {}
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            app.logger.warning("Another profiler is active, not dumping a cProfile for this request")
+        else:
+            g.profiler = profiler
+
+@app.after_request
+def finish_profiling(response):
+    stages = g.get('profile_stages')
+    if stages is None:
+        return response
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        profile_dir = os.path.join(DATA_DIR, 'profiles')
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint}-{uuid.uuid4().hex[:8]}.prof")
+        profiler.dump_stats(path)
+        response.headers['X-Profile-Dump'] = path
+    # Stages may overlap (an HA fetch inside a cache refresh counts once for each)
+    stages['total'] = time.perf_counter() - g.request_started
+    response.headers['Server-Timing'] = ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in stages.items())
+    return response
+
+# HTTP caching and compression
+StaticAsset = namedtuple('StaticAsset', 'digest mimetype variants')  # variants: encoding -> body
+
+COMPRESSIBLE_MIMETYPES = ('text/html', 'text/css', 'text/javascript', 'application/javascript', 'application/json')
+MIN_COMPRESS_SIZE = 1024
+
+def _encode(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+def _supported_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def _preferred_encoding(available):
+    """Best of the available content encodings for this request, or None for identity."""
+    return request.accept_encodings.best_match([encoding for encoding in _supported_encodings() if encoding in available])
+
+class StaticAssets:
+    """
+    Fingerprints every file in the static folder at startup and keeps it in
+    memory along with its compressed encodings, so static URLs can carry a
+    content hash (?v=...) and be cached by browsers forever.
+    """
+    def __init__(self, folder):
+        self.assets = {}
+        for root, _, files in os.walk(folder):
+            for name in files:
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    body = f.read()
+                mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                variants = {'identity': body}
+                if mimetype in COMPRESSIBLE_MIMETYPES and len(body) >= MIN_COMPRESS_SIZE:
+                    variants.update((encoding, _encode(body, encoding)) for encoding in _supported_encodings())
+                filename = os.path.relpath(path, folder).replace(os.sep, '/')
+                self.assets[filename] = StaticAsset(hashlib.sha256(body).hexdigest()[:12], mimetype, variants)
+
+    def get(self, filename):
+        return self.assets.get(filename)
+
+static_assets = StaticAssets(app.static_folder)
+
+def _build_version():
+    """Identifies this build's templates and static files, for ETags of rendered pages."""
+    digest = hashlib.sha1()
+    for filename in sorted(static_assets.assets):
+        digest.update(f"{filename}:{static_assets.assets[filename].digest}".encode())
+    for root, _, files in sorted(os.walk(os.path.join(app.root_path, app.template_folder))):
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+BUILD_VERSION = _build_version()
+
+@app.url_defaults
+def add_static_fingerprint(endpoint, values):
+    """Make url_for('static', ...) emit content-hashed URLs."""
+    if endpoint == 'static':
+        asset = static_assets.get(values.get('filename'))
+        if asset is not None:
+            values.setdefault('v', asset.digest)
+
+def serve_static(filename):
+    """Serve static files from memory, precompressed, with validators and long-lived caching."""
+    asset = static_assets.get(filename)
+    if asset is None:
+        return app.send_static_file(filename)
+
+    encoding = _preferred_encoding(asset.variants) or 'identity'
+    response = app.response_class(asset.variants[encoding], mimetype=asset.mimetype)
+    response.vary.add('Accept-Encoding')
+    if encoding == 'identity':
+        response.set_etag(asset.digest)
+    else:
+        response.headers['Content-Encoding'] = encoding
+        response.set_etag(f"{asset.digest}-{encoding}")
+    if request.args.get('v') == asset.digest:
+        # The URL changes whenever the content does
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 86400
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+app.view_functions['static'] = serve_static
+
+_compressed_bodies = OrderedDict()  # (etag, encoding) -> body, most recent last
+_compressed_bodies_lock = threading.Lock()
+MAX_COMPRESSED_BODIES = 16
+
+@app.after_request
+def compress_response(response):
+    """gzip/br-encode larger text responses; bodies with an ETag are compressed once."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_SIZE:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _preferred_encoding(_supported_encodings())
+    if encoding is None:
+        return response
 
-    return render_template('home.html', most_used=most_used, areas=display_areas, entities_by_area=entities_by_area, areas_map=areas_map)
+    etag, _ = response.get_etag()
+    key = (etag, encoding)
+    with _compressed_bodies_lock:
+        compressed = _compressed_bodies.get(key) if etag else None
+    if compressed is None:
+        compressed = _encode(body, encoding)
+        if etag:
+            with _compressed_bodies_lock:
+                _compressed_bodies[key] = compressed
+                while len(_compressed_bodies) > MAX_COMPRESSED_BODIES:
+                    _compressed_bodies.popitem(last=False)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        # Same content, different bytes: the validator is only weakly equal now
+        response.set_etag(etag, weak=True)
+    return response
+
+_rendered_home = (None, None)  # (etag, html) of the last rendered page
+
+@app.route('/')
+def home():
+    global _rendered_home
+    snapshot = get_serving_snapshot()
+    # The page only depends on the snapshot and this build's templates and assets
+    etag = f"{snapshot.etag}-{BUILD_VERSION}"
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        cached_etag, html = _rendered_home
+        if cached_etag != etag:
+            with _profile_stage('render'):
+                html = render_template('home.html', most_used=snapshot.most_used, areas=snapshot.areas,
+                                       app_data_json=snapshot.html_json, snapshot_etag=snapshot.etag)
+            _rendered_home = (etag, html)
+        response = app.response_class(html, mimetype='text/html')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True  # Always revalidate; unchanged pages cost a 304
+    return response
 
 @app.route('/api/data')
 def api_data():
-    """API endpoint that returns all data as JSON for SPA functionality"""
-    all_entities = get_all_scripts_and_scenes()
-    areas_map = get_areas()
+    """API endpoint that returns all data as JSON for SPA functionality. Supports If-None-Match."""
+    snapshot = get_serving_snapshot()
+    response = app.response_class(snapshot.body, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
-    # Group entities by area
-    entities_by_area = {"other": []}
-    for area_id in areas_map:
-        entities_by_area[area_id] = []
+# Live dashboard updates
+def diff_dashboard_data(old, new):
+    """
+    Describe the changes between two dashboard payloads: changed top-level keys
+    are sent whole, entities_by_area only for areas that changed (None when an
+    area disappeared). Returns an empty dict when nothing changed.
+    """
+    patch = {key: new[key] for key in ('most_used', 'areas', 'areas_map') if old.get(key) != new[key]}
 
-    for entity in all_entities:
-        area_id = entity.get('area_id')
-        if area_id and area_id in entities_by_area:
-            entities_by_area[area_id].append(entity)
-        else:
-            entities_by_area["other"].append(entity)
+    old_groups = old.get('entities_by_area', {})
+    new_groups = new['entities_by_area']
+    changed_groups = {area_id: entities for area_id, entities in new_groups.items() if old_groups.get(area_id) != entities}
+    changed_groups.update({area_id: None for area_id in old_groups if area_id not in new_groups})
+    if changed_groups:
+        patch['entities_by_area'] = changed_groups
+    return patch
 
-    # Sort entities within each area
-    for area_id in entities_by_area:
-        entities_by_area[area_id].sort(key=lambda x: x['name'].lower())
+class DashboardBroadcaster:
+    """
+    Pushes dashboard changes to Server-Sent Events subscribers. A single thread
+    picks up the current snapshot when dashboard cache keys change (and
+    periodically, to catch the hourly most-used rollover) and sends each
+    subscriber a diff. It only does work while somebody is subscribed.
+    Event ids are snapshot ETags, so clients can resume without a new snapshot.
+    """
+    def __init__(self, poll_interval=60, queue_size=100):
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.snapshot = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._thread = None
 
-    # Prepare areas for display
-    display_areas = []
-    if entities_by_area["other"]:
-        display_areas.append({"area_id": "other", "name": "Other"})
+    def subscribe(self):
+        """Register a subscriber; returns (queue, snapshot) with the snapshot to start from."""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        # Always re-read: while idle, _run doesn't follow changes. Built outside the
+        # lock, as on a cold cache this waits on Home Assistant
+        with app.app_context():
+            snapshot = get_serving_snapshot()
+        self._publish(snapshot)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='dashboard-broadcaster', daemon=True)
+                self._thread.start()
+            return subscriber, self.snapshot
 
-    sorted_area_names = sorted([name for id, name in areas_map.items()])
-    for area_name in sorted_area_names:
-        for area_id, name in areas_map.items():
-            if name == area_name and entities_by_area.get(area_id):
-                display_areas.append({"area_id": area_id, "name": name})
-                break
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
 
-    # Get most used scripts/scenes
-    most_used = get_most_used_entities()
+    def notify(self, keys):
+        """Cache listener: wake the broadcaster when dashboard data changed."""
+        if any(key in ('scripts_and_scenes', 'areas') or key.startswith('most_used_') for key in keys):
+            self._changed.set()
 
-    return jsonify({
-        'most_used': most_used,
-        'areas': display_areas,
-        'entities_by_area': entities_by_area,
-        'areas_map': areas_map
-    })
+    def _run(self):
+        while True:
+            self._changed.wait(self.poll_interval)
+            self._changed.clear()
+            with self._lock:
+                if not self._subscribers:
+                    continue
+            try:
+                with app.app_context():
+                    snapshot = get_serving_snapshot()
+                self._publish(snapshot)
+            except Exception as e:
+                app.logger.error(f"Error broadcasting dashboard update: {e}")
+
+    def _publish(self, snapshot):
+        with self._lock:
+            if self.snapshot is not None and snapshot.etag == self.snapshot.etag:
+                return
+            patch = diff_dashboard_data(self.snapshot.data if self.snapshot else {}, snapshot.data)
+            self.snapshot = snapshot
+            message = (snapshot.etag, patch)
+            for subscriber in list(self._subscribers):
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    # Too far behind; end its stream so EventSource reconnects for a fresh snapshot
+                    self._subscribers.discard(subscriber)
+                    try:
+                        while True:
+                            subscriber.get_nowait()
+                    except queue.Empty:
+                        subscriber.put_nowait(None)
+
+dashboard_broadcaster = DashboardBroadcaster()
+data_cache.add_listener(dashboard_broadcaster.notify)
+
+def _sse_message(event, event_id, body):
+    return f"event: {event}\nid: {event_id}\ndata: {body}\n\n"
+
+@app.route('/api/stream')
+def api_stream():
+    """
+    Server-Sent Events: an initial snapshot, then a patch whenever the dashboard
+    data changes. Clients that already hold the current data (Last-Event-ID
+    header or ?since=<etag>) skip the snapshot.
+    """
+    subscriber, snapshot = dashboard_broadcaster.subscribe()
+    known_etag = request.headers.get('Last-Event-ID') or request.args.get('since')
+
+    def stream():
+        try:
+            if known_etag != snapshot.etag:
+                yield _sse_message('snapshot', snapshot.etag, snapshot.body)
+            while True:
+                try:
+                    message = subscriber.get(timeout=15)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    return
+                etag, patch = message
+                yield _sse_message('patch', etag, app.json.dumps(patch))
+        finally:
+            dashboard_broadcaster.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/area/<area_id>')
 def area_detail(area_id):
     """Legacy route for backwards compatibility - redirects to home with hash"""
     return redirect(url_for('home') + f'#{area_id}')
 
+def _repeated_activation(activation_id):
+    """Response to a repeat tap: the outcome of the activation already underway."""
+    status = _get_activation_status(activation_id) or 'pending'
+    body = {'success': status == 'success', 'debounced': True, 'activation_id': activation_id}
+    if status == 'success':
+        return jsonify(dict(body, message='Entity was just activated'))
+    if status == 'failed':
+        return jsonify(dict(body, message='Failed to activate entity')), 500
+    return jsonify(dict(body, pending=True, message='Entity activation already requested')), 202
+
 @app.route('/activate/<entity_id>')
 def activate_entity(entity_id):
-    domain = entity_id.split('.')[0]
     service = "turn_on"
 
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("INSERT INTO usage_log (entity_id) VALUES (?)", (entity_id,))
-    db.commit()
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    activation_id, is_new = claim_activations([entity_id])[entity_id]
+    if not is_new:
+        if is_ajax:
+            return _repeated_activation(activation_id)
+        return redirect(url_for('home'))
 
-    result = call_ha_service(domain, service, entity_id)
+    usage_writer.record(entity_id)
+
+    # Optimistic mode acknowledges right away; the outcome is reported out-of-band
+    optimistic = request.args.get('optimistic', '1' if OPTIMISTIC_ACTIVATION else '0') == '1'
+    if optimistic:
+        start_activations({entity_id: activation_id}, service)
+        if is_ajax:
+            return jsonify({
+                'success': True,
+                'pending': True,
+                'activation_id': activation_id,
+                'message': 'Entity activation requested'
+            }), 202
+        return redirect(url_for('home'))
+
+    result = activate_service(entity_id, service)
+    finish_activation(entity_id, activation_id, result)
     
     # Check if this is an AJAX request
-    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+    if is_ajax:
         if result:
             return jsonify({'success': True, 'message': 'Entity activated successfully'})
         else:
@@ -432,64 +2520,119 @@ def activate_entity(entity_id):
         # Legacy support for direct URL access
         return redirect(url_for('home'))
 
+@app.route('/api/activate', methods=['POST'])
+def activate_entities():
+    """
+    Activates several entities at once: {"entity_ids": [...]}. All service calls
+    go out as one WebSocket burst and usage is logged in one transaction.
+    Entities repeated within the debounce window are not called again; they
+    report the status (and activation_id) of the activation already underway.
+    """
+    payload = request.get_json(silent=True)
+    entity_ids = payload.get('entity_ids') if isinstance(payload, dict) else None
+    if (not isinstance(entity_ids, list) or not entity_ids
+            or not all(isinstance(entity_id, str) and '.' in entity_id for entity_id in entity_ids)):
+        return jsonify({'success': False, 'message': 'entity_ids must be a non-empty list of entity ids'}), 400
+    entity_ids = list(dict.fromkeys(entity_ids))  # Drop duplicates, keep order
+    if len(entity_ids) > MAX_BATCH_ACTIVATIONS:
+        return jsonify({'success': False,
+                        'message': f'At most {MAX_BATCH_ACTIVATIONS} entities per request'}), 400
+    optimistic = payload.get('optimistic', OPTIMISTIC_ACTIVATION)
+    if not isinstance(optimistic, bool):
+        return jsonify({'success': False, 'message': 'optimistic must be true or false'}), 400
+
+    claimed = claim_activations(entity_ids)
+    started = {entity_id: activation_id for entity_id, (activation_id, is_new) in claimed.items() if is_new}
+    results = {}
+    for entity_id, (activation_id, is_new) in claimed.items():
+        if not is_new:
+            status = _get_activation_status(activation_id) or 'pending'
+            results[entity_id] = {'status': status, 'activation_id': activation_id, 'debounced': True}
+    if started:
+        usage_writer.record_many(list(started))
+
+    if optimistic:
+        start_activations(started)
+        for entity_id, activation_id in started.items():
+            results[entity_id] = {'status': 'pending', 'activation_id': activation_id}
+    else:
+        outcomes = _run_activations(started, 'turn_on') if started else {}
+        for entity_id, activation_id in started.items():
+            results[entity_id] = {'status': 'success' if outcomes[entity_id] else 'failed',
+                                  'activation_id': activation_id}
+
+    statuses = {result['status'] for result in results.values()}
+    if 'failed' in statuses:
+        code = 500
+    elif 'pending' in statuses:
+        code = 202
+    else:
+        code = 200
+    return jsonify({'success': 'failed' not in statuses, 'pending': 'pending' in statuses,
+                    'results': {entity_id: results[entity_id] for entity_id in entity_ids}}), code
+
+@app.route('/api/activations/<activation_id>')
+def activation_status(activation_id):
+    """Reports the outcome of an optimistic activation: pending, success or failed."""
+    status = _get_activation_status(activation_id)
+    if status is None:
+        return jsonify({'success': False, 'message': 'Unknown activation'}), 404
+    return jsonify({'activation_id': activation_id, 'status': status})
+
+def _most_used_slot(now=None):
+    """
+    The (day_type, hour) ranking slot for a UTC time, by default now. Usage is
+    recorded by UTC timestamp, so rankings are looked up on the same clock.
+    """
+    now = now or datetime.now(timezone.utc)
+    return _ranking_day_type(now.date()), now.hour
+
 def get_most_used_entities():
     """
     Gets most used entities at current time of day.
     Uses cache-first approach with background refresh.
     """
-    # Create cache key based on current hour to ensure time-relevant caching
-    current_hour = datetime.now().hour
-    cache_key = f'most_used_{current_hour}'
+    # Create cache key based on current slot to ensure time-relevant caching
+    day_type, current_hour = _most_used_slot()
+    cache_key = f'most_used_{day_type}_{current_hour}'
     cached_data = data_cache.get(cache_key)
     
     # Return cached data if available
     if cached_data is not None:
-        app.logger.debug(f"Returning cached most used entities for hour {current_hour}")
+        app.logger.debug("Returning cached most used entities for hour %s", current_hour)
         # Start background refresh if cache is stale
         if data_cache.is_stale(cache_key):
-            threading.Thread(target=_refresh_most_used_cache, args=(current_hour,), daemon=True).start()
+            single_flight.submit(cache_key, _refresh_most_used_cache, day_type, current_hour)
         return cached_data
     
-    # No cache available, fetch immediately
-    app.logger.debug(f"No cache available, fetching most used entities for hour {current_hour}")
-    most_used = _fetch_most_used_entities()
-    data_cache.set(cache_key, most_used)
-    return most_used
-
-def _fetch_most_used_entities():
-    """Internal function to fetch most used entities from database."""
+    # No cache available, fetch immediately (joining any fetch already in flight)
+    app.logger.debug("No cache available, fetching most used entities for hour %s", current_hour)
+    most_used = single_flight.do(cache_key, _refresh_most_used_cache, day_type, current_hour)
+    return most_used if most_used is not None else []
+
+MOST_USED_SQL = '''
+    SELECT entity_id, count
+    FROM most_used_scores
+    WHERE day_type = ? AND hour = ?
+    ORDER BY score DESC, count DESC
+'''
+
+def _fetch_most_used_entities(day_type, hour):
+    """
+    Internal function to read a slot's precomputed ranking from the database.
+    Returns None while scripts and scenes can't be fetched from HA.
+    """
     db = get_db()
-    cursor = db.cursor()
-
-    now = datetime.now()
-    start_time_window = (now - timedelta(hours=1)).time()
-    end_time_window = (now + timedelta(hours=1)).time()
-    thirty_days_ago = now - timedelta(days=30)
-
-    cursor.execute('''
-        SELECT entity_id, COUNT(*) as count, STRFTIME('%H:%M:%S', timestamp) as time_of_day
-        FROM usage_log
-        WHERE timestamp >= ?
-        GROUP BY entity_id, time_of_day
-        ORDER BY count DESC
-    ''', (thirty_days_ago,))
-    raw_usage_data = cursor.fetchall()
-
-    filtered_usage = {}
-    for row in raw_usage_data:
-        log_time = datetime.strptime(row['time_of_day'], '%H:%M:%S').time()
-        if start_time_window <= end_time_window:
-            if start_time_window <= log_time <= end_time_window:
-                filtered_usage[row['entity_id']] = filtered_usage.get(row['entity_id'], 0) + row['count']
-        else:
-            if log_time >= start_time_window or log_time <= end_time_window:
-                filtered_usage[row['entity_id']] = filtered_usage.get(row['entity_id'], 0) + row['count']
+    with _timed_query('most_used'):
+        ranking = db.execute(MOST_USED_SQL, (day_type, hour)).fetchall()
 
     all_entities = get_all_scripts_and_scenes()
+    if not all_entities and data_cache.get('scripts_and_scenes') is None:
+        return None  # HA unavailable; names unknown, so don't cache an empty ranking
     entity_name_map = {e['entity_id']: e['name'] for e in all_entities}
 
     most_used_list = []
-    for entity_id, count in sorted(filtered_usage.items(), key=lambda item: item[1], reverse=True):
+    for entity_id, count in ranking:
         if entity_id in entity_name_map:
             most_used_list.append({
                 'entity_id': entity_id,
@@ -501,15 +2644,32 @@ def _fetch_most_used_entities():
                 break
     return most_used_list
 
-def _refresh_most_used_cache(hour):
-    """Background thread function to refresh most used entities cache."""
+def _refresh_most_used_cache(day_type, hour):
+    """Refreshes the most used entities cache for a slot. Returns the list, or None on failure."""
     try:
-        app.logger.debug(f"Background refresh of most used entities cache started for hour {hour}")
-        most_used = _fetch_most_used_entities()
-        data_cache.set(f'most_used_{hour}', most_used)
-        app.logger.debug(f"Background refresh of most used entities cache completed for hour {hour}")
+        app.logger.debug("Refresh of most used entities cache started for hour %s", hour)
+        # Runs on refresh worker threads too, each with its own pooled connection
+        try:
+            most_used = _fetch_most_used_entities(day_type, hour)
+        finally:
+            usage_db.release()
+        if most_used is None:
+            return None
+        data_cache.set(f'most_used_{day_type}_{hour}', most_used)
+        app.logger.debug("Refresh of most used entities cache completed for hour %s", hour)
+        return most_used
     except Exception as e:
-        app.logger.error(f"Error during background refresh of most used entities: {e}")
+        app.logger.error(f"Error during refresh of most used entities: {e}")
+        return None
+
+def _on_usage_recorded():
+    """Re-read the current slot's ranking once new activations have bumped it."""
+    day_type, hour = _most_used_slot()
+    single_flight.submit(f'most_used_{day_type}_{hour}', _refresh_most_used_cache, day_type, hour, force=True)
+
+usage_writer.add_listener(_on_usage_recorded)
+ranking_engine.add_listener(lambda: data_cache.clear_cache_pattern('most_used_'))
+ranking_engine.start()
 
 @app.route('/api/refresh-cache')
 def refresh_cache():
@@ -522,14 +2682,16 @@ def refresh_cache():
         app.logger.info("Cleared all most_used cache entries")
         
         # Refresh most_used cache immediately (not in background) to apply 5-item limit
-        current_hour = datetime.now().hour
-        most_used = _fetch_most_used_entities()
-        data_cache.set(f'most_used_{current_hour}', most_used)
+        day_type, current_hour = _most_used_slot()
+        most_used = single_flight.do(f'most_used_{day_type}_{current_hour}', _refresh_most_used_cache,
+                                     day_type, current_hour, force=True)
+        if most_used is None:
+            raise RuntimeError('most used entities could not be refreshed')
         app.logger.info(f"Immediately refreshed most_used cache for hour {current_hour} with {len(most_used)} items")
         
-        # Refresh other caches in background threads
-        threading.Thread(target=_refresh_scripts_and_scenes_cache, daemon=True).start()
-        threading.Thread(target=_refresh_areas_cache, daemon=True).start()
+        # Refresh other caches in the background
+        single_flight.submit('scripts_and_scenes', _refresh_scripts_and_scenes_cache, force=True)
+        single_flight.submit('areas', _refresh_areas_cache, force=True)
         
         return jsonify({
             'success': True,
@@ -543,5 +2705,85 @@ def refresh_cache():
             'message': f'Cache refresh failed: {str(e)}'
         }), 500
 
+# Warm-up
+class WarmUp:
+    """
+    Fills the caches at boot instead of on the first request: areas, scripts and
+    scenes, and the most-used ranking are fetched concurrently, then the
+    dashboard snapshot is built. Retries with backoff while Home Assistant is
+    unreachable.
+    """
+    def __init__(self, max_backoff=60):
+        self.max_backoff = max_backoff
+        self.started = None
+        self.finished = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self):
+        """Start warming up in the background if not already started."""
+        with self._start_lock:
+            if self._thread is None:
+                self.started = time.time()
+                self._thread = threading.Thread(target=self._run, name='warm-up', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        backoff = 1
+        while True:
+            try:
+                with ThreadPoolExecutor(max_workers=3, thread_name_prefix='warm-up') as executor:
+                    fetches = [executor.submit(fn) for fn in (get_all_scripts_and_scenes, get_areas, get_most_used_entities)]
+                    for fetch in fetches:
+                        fetch.result()
+                # Getters fall back to empty data when HA is down; only a cached fetch counts
+                day_type, hour = _most_used_slot()
+                if data_cache.get('scripts_and_scenes') is None or data_cache.get('areas') is None:
+                    app.logger.warning(f"Warm-up could not reach Home Assistant, retrying in {backoff}s")
+                elif data_cache.get(f'most_used_{day_type}_{hour}') is None:
+                    # A ranking rebuild finishing at boot clears the slot we just cached
+                    app.logger.debug("Most-used ranking not cached yet, retrying warm-up in %ss", backoff)
+                else:
+                    get_dashboard_snapshot()
+                    break
+            except Exception as e:
+                app.logger.error(f"Error during warm-up, retrying in {backoff}s: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+        self.finished = time.time()
+        self._ready.set()
+        app.logger.info(f"Warm-up completed in {self.finished - self.started:.2f}s")
+
+warm_up = WarmUp()
+warm_up.start()
+
+@app.route('/api/ready')
+def readiness():
+    """
+    Readiness probe for the container healthcheck: 200 once warm, or while a
+    last known good snapshot can be served during warm-up; 503 otherwise.
+    """
+    can_serve = warm_up.ready or data_cache.get('last_good_snapshot') is not None
+    return jsonify({
+        'ready': can_serve,
+        'warm': warm_up.ready,
+        'warm_up_seconds': round(warm_up.finished - warm_up.started, 3) if warm_up.finished else None,
+    }), 200 if can_serve else 503
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics; under gunicorn, summed over all worker processes."""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
 if __name__ == '__main__':
     app.run(debug=True, port=5003)
@@ -0,0 +1,306 @@
+"""
+Stand-in for the Home Assistant REST and WebSocket APIs, for benchmarks.
+
+    python bench/fake_ha.py --port 8123 --scripts 50 --sensors 2000 --areas 8 \
+        --latency 0.02 --failure-rate 0.05
+
+Serves the endpoints and WebSocket commands the dashboard uses, with
+configurable entity/area counts, added latency and a rate of injected
+failures (HTTP 500 for REST, an error result for WebSocket commands).
+Control endpoints for the harness:
+
+    GET  /_stats   request counters
+    POST /_event   broadcast {"event_type": ..., "data": ...} to subscribers
+    POST /_drop    drop every WebSocket connection
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class FakeHomeAssistant:
+    """Entity, area and registry data plus the knobs for latency and failures."""
+    def __init__(self, scripts=50, sensors=2000, areas=8, latency=0.0, jitter=0.0, failure_rate=0.0, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.areas = [{'area_id': f'area_{i}', 'name': f'Area {i}'} for i in range(areas)]
+        self.states = []
+        self.registry = []
+        for i in range(scripts):
+            for domain in ('script', 'scene'):
+                entity_id = f'{domain}.{domain}_{i}'
+                self.states.append({
+                    'entity_id': entity_id,
+                    'state': 'off',
+                    'attributes': {'friendly_name': f'{domain.title()} {i}'},
+                })
+                # About a third of the entities have no area
+                area_id = f'area_{i % areas}' if areas and i % 3 else None
+                self.registry.append({'entity_id': entity_id, 'area_id': area_id, 'platform': domain})
+        # Sensors make /api/states realistically large; the dashboard filters them out
+        for i in range(sensors):
+            entity_id = f'sensor.sensor_{i}'
+            self.states.append({
+                'entity_id': entity_id,
+                'state': str(i),
+                'attributes': {'friendly_name': f'Sensor {i}', 'unit_of_measurement': 'W', 'icon': 'mdi:flash'},
+            })
+            self.registry.append({'entity_id': entity_id, 'area_id': None, 'platform': 'demo'})
+        self.stats = {'rest': 0, 'ws_connections': 0, 'ws_commands': 0, 'services': 0, 'failures': 0}
+        self.clients = []  # (socket, {subscription id: event_type})
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()  # One frame at a time on any socket
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+
+    def should_fail(self):
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            self.count('failures')
+            return True
+        return False
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def broadcast(self, event):
+        with self.lock:
+            clients = [(sock, dict(subs)) for sock, subs in self.clients]
+        for sock, subs in clients:
+            for subscription_id, event_type in subs.items():
+                if event_type in (None, event.get('event_type')):
+                    try:
+                        with self.send_lock:
+                            ws_send(sock, {'id': subscription_id, 'type': 'event', 'event': event})
+                    except OSError:
+                        pass
+
+    def drop_connections(self):
+        with self.lock:
+            for sock, _ in self.clients:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def command(self, msg, subs):
+        """Result of one WebSocket command, or raises KeyError for unknown commands."""
+        msg_type = msg['type']
+        if msg_type == 'get_states':
+            return self.states
+        if msg_type == 'config/area_registry/list':
+            return self.areas
+        if msg_type == 'config/entity_registry/list':
+            return self.registry
+        if msg_type == 'config/entity_registry/list_for_display':
+            return {
+                'entity_categories': {},
+                'entities': [{'ei': r['entity_id'], 'ai': r['area_id'], 'pl': r['platform']} for r in self.registry],
+            }
+        if msg_type == 'config/entity_registry/get':
+            for entry in self.registry:
+                if entry['entity_id'] == msg.get('entity_id'):
+                    return entry
+            raise LookupError('Entity not found')
+        if msg_type == 'subscribe_events':
+            subs[msg['id']] = msg.get('event_type')
+            return None
+        if msg_type == 'unsubscribe_events':
+            subs.pop(msg.get('subscription'), None)
+            return None
+        if msg_type == 'call_service':
+            self.count('services')
+            return {'context': {'id': f'{msg["id"]:032x}'}}
+        raise KeyError(msg_type)
+
+
+def ws_send(sock, obj):
+    data = json.dumps(obj).encode()
+    header = bytearray([0x81])  # FIN + text frame
+    if len(data) < 126:
+        header.append(len(data))
+    elif len(data) < 65536:
+        header.append(126)
+        header += struct.pack('>H', len(data))
+    else:
+        header.append(127)
+        header += struct.pack('>Q', len(data))
+    sock.sendall(bytes(header) + data)
+
+
+def _recv_exact(sock, n):
+    buf = b''
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError('Client closed the connection')
+        buf += chunk
+    return buf
+
+
+def ws_recv(sock):
+    b1, b2 = _recv_exact(sock, 2)
+    opcode = b1 & 0x0F
+    length = b2 & 0x7F
+    if length == 126:
+        length = struct.unpack('>H', _recv_exact(sock, 2))[0]
+    elif length == 127:
+        length = struct.unpack('>Q', _recv_exact(sock, 8))[0]
+    mask = _recv_exact(sock, 4) if b2 & 0x80 else b'\0\0\0\0'
+    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(_recv_exact(sock, length)))
+    if opcode == 0x8:
+        raise ConnectionError('Client sent close frame')
+    return json.loads(payload)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    ha = None  # FakeHomeAssistant, set by serve()
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path == '/api/websocket':
+            return self._websocket()
+        if self.path == '/_stats':
+            return self._json(self.ha.stats)
+
+        self.ha.count('rest')
+        self.ha.delay()
+        if self.ha.should_fail():
+            return self._json({'message': 'Injected failure'}, 500)
+        if self.path == '/api/states':
+            return self._json(self.ha.states)
+        if self.path.startswith('/api/states/'):
+            entity_id = self.path.rsplit('/', 1)[1]
+            for state in self.ha.states:
+                if state['entity_id'] == entity_id:
+                    return self._json(state)
+        self._json({'message': 'Entity not found.'}, 404)
+
+    def do_POST(self):
+        body = self._read_json()
+        if self.path == '/_event':
+            self.ha.broadcast(body)
+            return self._json({'ok': True})
+        if self.path == '/_drop':
+            self.ha.drop_connections()
+            return self._json({'ok': True})
+
+        self.ha.count('rest')
+        self.ha.delay()
+        if self.ha.should_fail():
+            return self._json({'message': 'Injected failure'}, 500)
+        if self.path.startswith('/api/services/'):
+            self.ha.count('services')
+            return self._json([])
+        self._json({'message': 'Not found'}, 404)
+
+    def _websocket(self):
+        accept = base64.b64encode(hashlib.sha1((self.headers['Sec-WebSocket-Key'] + WS_GUID).encode()).digest())
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept.decode())
+        self.end_headers()
+        self.close_connection = True
+
+        sock = self.connection
+        subs = {}
+        self.ha.count('ws_connections')
+        try:
+            ws_send(sock, {'type': 'auth_required', 'ha_version': '2024.1.0'})
+            ws_recv(sock)  # Any token is accepted
+            ws_send(sock, {'type': 'auth_ok', 'ha_version': '2024.1.0'})
+            with self.ha.lock:
+                self.ha.clients.append((sock, subs))
+            while True:
+                msg = ws_recv(sock)
+                if msg.get('type') == 'ping':
+                    with self.ha.send_lock:
+                        ws_send(sock, {'id': msg.get('id'), 'type': 'pong'})
+                    continue
+                # Answer off the read loop so pipelined commands overlap, like HA does
+                threading.Thread(target=self._answer, args=(sock, msg, subs), daemon=True).start()
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            with self.ha.lock:
+                self.ha.clients[:] = [client for client in self.ha.clients if client[0] is not sock]
+
+    def _answer(self, sock, msg, subs):
+        self.ha.count('ws_commands')
+        self.ha.delay()
+        try:
+            if msg['type'] != 'subscribe_events' and self.ha.should_fail():
+                raise RuntimeError('Injected failure')
+            reply = {'id': msg['id'], 'type': 'result', 'success': True, 'result': self.ha.command(msg, subs)}
+        except KeyError:
+            reply = {'id': msg['id'], 'type': 'result', 'success': False,
+                     'error': {'code': 'unknown_command', 'message': 'Unknown command.'}}
+        except (LookupError, RuntimeError) as e:
+            reply = {'id': msg['id'], 'type': 'result', 'success': False,
+                     'error': {'code': 'home_assistant_error', 'message': str(e)}}
+        try:
+            with self.ha.send_lock:
+                ws_send(sock, reply)
+        except OSError:
+            pass
+
+
+def serve(ha, host='127.0.0.1', port=8123):
+    handler = type('BoundHandler', (Handler,), {'ha': ha})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8123)
+    parser.add_argument('--scripts', type=int, default=50, help='scripts (and as many scenes) to serve')
+    parser.add_argument('--sensors', type=int, default=2000, help='untracked entities padding /api/states')
+    parser.add_argument('--areas', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request/command')
+    parser.add_argument('--jitter', type=float, default=0.0, help='+- seconds of random latency')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests/commands that fail')
+    args = parser.parse_args()
+
+    ha = FakeHomeAssistant(args.scripts, args.sensors, args.areas, args.latency, args.jitter, args.failure_rate)
+    server = serve(ha, args.host, args.port)
+    print(f'Fake Home Assistant listening on http://{args.host}:{args.port}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
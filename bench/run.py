@@ -0,0 +1,372 @@
+"""
+Benchmark harness for the dashboard, run against bench/fake_ha.py.
+
+    python bench/run.py                        # every scenario, default sizes
+    python bench/run.py --scenario warm --requests 2000 --concurrency 16
+    python bench/run.py --latency 0.05 --failure-rate 0.1 --json results.json
+
+Starts the fake Home Assistant and the app, each in its own process, with a
+fresh data directory whose usage_log is seeded with --usage-rows activations.
+Scenarios:
+
+    cold     restart the app on an empty cache and time the first / and /api/data
+    warm     steady load on /, /api/data and /activate/<entity_id>
+    refresh  /api/data under load while /api/refresh-cache runs and HA sends
+             state changes, so cache refreshes race with readers
+
+Reports p50/p95/p99 latency, throughput and errors per endpoint, and the
+app process's peak RSS (Linux only).
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# Serve the app with the threaded werkzeug server, as `flask run` does
+SERVE_APP = '''
+import sys
+from werkzeug.serving import make_server
+import app
+make_server('127.0.0.1', int(sys.argv[1]), app.app, threaded=True).serve_forever()
+'''
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'Nothing listening on port {port} after {timeout}s')
+
+
+def peak_rss_kib(pid):
+    """High-water mark of a process's resident set size, or None off Linux."""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def seed_usage(database, rows, scripts, days=120, seed=1):
+    """
+    Fill usage_log with activations of scripts and scenes over the last `days`
+    days. Usage is skewed like a real household: a few entities dominate, and
+    each is mostly used around its own time of day.
+    """
+    rng = random.Random(seed)
+    entity_ids = [f'{domain}.{domain}_{i}' for i in range(scripts) for domain in ('script', 'scene')]
+    weights = [1 / (rank + 1) for rank in range(len(entity_ids))]
+    usual_minute = {entity_id: rng.randrange(1440) for entity_id in entity_ids}
+    now = datetime.now(timezone.utc)
+
+    db = sqlite3.connect(database)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS usage_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity_id TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    batch = []
+    for entity_id in rng.choices(entity_ids, weights, k=rows):
+        minute = int(rng.gauss(usual_minute[entity_id], 90)) % 1440
+        day = now - timedelta(days=rng.randrange(days))
+        ts = day.replace(hour=minute // 60, minute=minute % 60, second=rng.randrange(60))
+        batch.append((entity_id, ts.strftime('%Y-%m-%d %H:%M:%S')))
+    db.executemany('INSERT INTO usage_log (entity_id, timestamp) VALUES (?, ?)', batch)
+    db.commit()
+    db.close()
+
+
+class Process:
+    """A child process that is stopped on exit from the with block."""
+    def __init__(self, args, port, env=None, log_path=None, cwd=None):
+        self.port = port
+        self._log = open(log_path or os.devnull, 'ab')
+        self.proc = subprocess.Popen(args, cwd=cwd, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+        try:
+            wait_for_port(port)
+        except Exception:
+            self.stop()
+            raise
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def peak_rss_kib(self):
+        return peak_rss_kib(self.proc.pid)
+
+    def stop(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self._log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def start_fake_ha(args):
+    port = free_port()
+    return Process([
+        sys.executable, os.path.join(BENCH_DIR, 'fake_ha.py'), '--port', str(port),
+        '--scripts', str(args.scripts), '--sensors', str(args.sensors), '--areas', str(args.areas),
+        '--latency', str(args.latency), '--jitter', str(args.jitter), '--failure-rate', str(args.failure_rate),
+    ], port)
+
+
+def start_app(ha, data_dir):
+    port = free_port()
+    # Debouncing would turn the repeated /activate load into early returns
+    env = dict(os.environ, HA_URL=ha.url, HA_TOKEN='benchmark', DATA_DIR=data_dir, ACTIVATION_DEBOUNCE_SECONDS='0')
+    return Process([sys.executable, '-c', SERVE_APP, str(port)], port, env=env,
+                   log_path=os.path.join(data_dir, 'app.log'), cwd=REPO_DIR)
+
+
+def load(url, paths, requests_total, concurrency, headers=None):
+    """
+    Issue requests_total GETs, cycling through paths, from `concurrency`
+    threads. Returns {path: {'latencies': [...], 'errors': n}} and wall time.
+    """
+    results = {path: {'latencies': [], 'errors': 0} for path in paths}
+    lock = threading.Lock()
+    local = threading.local()
+
+    def one(i):
+        path = paths[i % len(paths)]
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            ok = session.get(url + path, headers=headers, timeout=30).status_code < 400
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            results[path]['latencies'].append(elapsed)
+            if not ok:
+                results[path]['errors'] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(one, range(requests_total)))
+    return results, time.perf_counter() - started
+
+
+def summarize(latencies, errors, wall_time):
+    ordered = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 2) if seconds is not None else None
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'p50_ms': ms(percentile(ordered, 50)),
+        'p95_ms': ms(percentile(ordered, 95)),
+        'p99_ms': ms(percentile(ordered, 99)),
+        'throughput_rps': round(len(ordered) / wall_time, 1) if wall_time else None,
+    }
+
+
+def fresh_data_dir(template):
+    data_dir = tempfile.mkdtemp(prefix='hapd-bench-')
+    shutil.copy(os.path.join(template, 'usage.db'), os.path.join(data_dir, 'usage.db'))
+    return data_dir
+
+
+def scenario_cold(args, ha, template):
+    first = {'/': [], '/api/data': []}
+    peak = []
+    for _ in range(args.cold_runs):
+        data_dir = fresh_data_dir(template)
+        try:
+            with start_app(ha, data_dir) as app_proc:
+                for path in first:
+                    started = time.perf_counter()
+                    requests.get(app_proc.url + path, timeout=60)
+                    first[path].append(time.perf_counter() - started)
+                peak.append(app_proc.peak_rss_kib())
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return {
+        'endpoints': {path: summarize(latencies, 0, sum(latencies)) for path, latencies in first.items()},
+        'peak_rss_kib': max(peak) if None not in peak else None,
+    }
+
+
+def scenario_warm(args, ha, template):
+    data_dir = fresh_data_dir(template)
+    try:
+        with start_app(ha, data_dir) as app_proc:
+            load(app_proc.url, ['/', '/api/data'], 20, 2)  # Fill the caches
+            time.sleep(1)
+            endpoints = {}
+            for path in ('/', '/api/data', '/activate/script.script_0'):
+                # The activation route answers JSON to XHR requests, like the page's fetch()
+                results, wall = load(app_proc.url, [path], args.requests, args.concurrency,
+                                     headers={'X-Requested-With': 'XMLHttpRequest'})
+                endpoints[path] = summarize(results[path]['latencies'], results[path]['errors'], wall)
+            return {'endpoints': endpoints, 'peak_rss_kib': app_proc.peak_rss_kib()}
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def scenario_refresh(args, ha, template):
+    data_dir = fresh_data_dir(template)
+    try:
+        with start_app(ha, data_dir) as app_proc:
+            load(app_proc.url, ['/', '/api/data'], 20, 2)
+            time.sleep(1)
+            stop = threading.Event()
+            refreshes = {'latencies': [], 'errors': 0}
+
+            def refresh_loop():
+                session = requests.Session()
+                while not stop.is_set():
+                    started = time.perf_counter()
+                    try:
+                        ok = session.get(app_proc.url + '/api/refresh-cache', timeout=60).ok
+                    except requests.RequestException:
+                        ok = False
+                    refreshes['latencies'].append(time.perf_counter() - started)
+                    refreshes['errors'] += not ok
+                    stop.wait(args.refresh_interval)
+
+            def event_loop():
+                session = requests.Session()
+                rng = random.Random(2)
+                while not stop.is_set():
+                    entity_id = f'script.script_{rng.randrange(args.scripts)}'
+                    state = {'entity_id': entity_id, 'state': rng.choice(['on', 'off']),
+                             'attributes': {'friendly_name': f'Script {entity_id.rsplit("_", 1)[1]}'}}
+                    session.post(ha.url + '/_event', json={
+                        'event_type': 'state_changed',
+                        'data': {'entity_id': entity_id, 'new_state': state},
+                    }, timeout=10)
+                    stop.wait(1 / args.event_rate)
+
+            background = [threading.Thread(target=refresh_loop), threading.Thread(target=event_loop)]
+            for thread in background:
+                thread.start()
+            started = time.perf_counter()
+            try:
+                results, wall = load(app_proc.url, ['/api/data'], args.requests, args.concurrency)
+            finally:
+                stop.set()
+                for thread in background:
+                    thread.join()
+            return {
+                'endpoints': {
+                    '/api/data': summarize(results['/api/data']['latencies'], results['/api/data']['errors'], wall),
+                    '/api/refresh-cache': summarize(refreshes['latencies'], refreshes['errors'],
+                                                    time.perf_counter() - started),
+                },
+                'peak_rss_kib': app_proc.peak_rss_kib(),
+            }
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+SCENARIOS = {'cold': scenario_cold, 'warm': scenario_warm, 'refresh': scenario_refresh}
+
+
+def prepare_template(args, ha):
+    """Seed usage_log once and let the app build its histogram, so runs start from the same data."""
+    template = tempfile.mkdtemp(prefix='hapd-bench-template-')
+    database = os.path.join(template, 'usage.db')
+    seed_usage(database, args.usage_rows, args.scripts)
+    start_app(ha, template).stop()
+    # Fold the WAL back into usage.db, since runs copy only that file
+    db = sqlite3.connect(database)
+    db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    db.close()
+    return template
+
+
+def print_report(report):
+    print(f"{'scenario':<10} {'endpoint':<28} {'n':>6} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+    for name, result in report.items():
+        for path, stats in result['endpoints'].items():
+            print(f"{name:<10} {path:<28} {stats['requests']:>6} {stats['errors']:>5} "
+                  f"{stats['p50_ms']!s:>9} {stats['p95_ms']!s:>9} {stats['p99_ms']!s:>9} {stats['throughput_rps']!s:>8}")
+        rss = result['peak_rss_kib']
+        print(f"{name:<10} {'peak RSS':<28} {f'{rss / 1024:.1f} MiB' if rss else 'n/a':>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--cold-runs', type=int, default=10, help='app restarts in the cold scenario')
+    parser.add_argument('--usage-rows', type=int, default=200000, help='usage_log rows to seed')
+    parser.add_argument('--scripts', type=int, default=50)
+    parser.add_argument('--sensors', type=int, default=2000)
+    parser.add_argument('--areas', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.01, help='fake HA latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.005)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--refresh-interval', type=float, default=0.2, help='seconds between /api/refresh-cache calls')
+    parser.add_argument('--event-rate', type=float, default=20, help='state_changed events per second')
+    parser.add_argument('--json', metavar='PATH', help='also write the results as JSON')
+    args = parser.parse_args()
+
+    report = {}
+    with start_fake_ha(args) as ha:
+        template = prepare_template(args, ha)
+        try:
+            for name in args.scenario:
+                report[name] = SCENARIOS[name](args, ha, template)
+        finally:
+            shutil.rmtree(template, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
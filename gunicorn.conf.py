@@ -0,0 +1,38 @@
+# Production server settings: gunicorn -c gunicorn.conf.py app:app
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5003')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# Threaded workers. Every open /api/stream connection holds one thread for as
+# long as the client stays connected, so workers x threads must exceed the
+# number of dashboards left open (tablets, tabs) or other requests queue.
+# SSE_CLIENTS is that expected number; WEB_THREADS overrides the result.
+worker_class = 'gthread'
+sse_clients = int(os.environ.get('SSE_CLIENTS', 16))
+threads = int(os.environ.get('WEB_THREADS', 8 + math.ceil(sse_clients / workers)))
+timeout = 60
+
+# Each worker opens its own SQLite connections and background threads
+preload_app = False
+
+# Workers share the cache through data/cache.db and elect one HA event follower
+raw_env = ['SHARED_CACHE=true']
+
+# Workers write Prometheus samples here; /metrics aggregates them
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'hapd-metrics'))
+
+
+def on_starting(server):
+    # Samples left by a previous run would be added to this one's
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)